@@ -6,21 +6,61 @@ admin system, broadcast, video autosync, and Railway deployment support.
 
 import os
 import json
+import gzip
+import marshal
+import struct
+import sys
+import zlib
 import logging
 import asyncio
-from datetime import datetime
-from typing import Optional, List, Dict, Any
-
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
+import functools
+import hashlib
+import hmac
+import io
+import itertools
+import random
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, Awaitable, Callable, Deque, Iterable, Iterator, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows - file locks become no-ops
+    fcntl = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    CallbackQuery,
+    InlineQueryResultCachedDocument,
+    InlineQueryResultCachedVideo,
+    InlineQueryResultsButton,
+)
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    ChatMemberHandler,
     ContextTypes,
+    InlineQueryHandler,
+    TypeHandler,
+    ApplicationHandlerStop,
     filters,
     ConversationHandler,
 )
+from telegram.request import HTTPXRequest
 
 # =============================================================================
 # CONFIGURATION & CONSTANTS
@@ -39,11 +79,107 @@ CODES_FILE = os.path.join(DATA_DIR, "codes.json")
 FORCE_FILE = os.path.join(DATA_DIR, "force.json")
 ADMINS_FILE = os.path.join(DATA_DIR, "admins.json")
 VIDEOS_FILE = os.path.join(DATA_DIR, "videos.json")
+COLD_USERS_FILE = os.path.join(DATA_DIR, "users_cold.jsonl.gz")
 CHANNEL_FILE = os.path.join(DATA_DIR, "channel.json")
+CHECKPOINT_FILE = os.path.join(DATA_DIR, "checkpoint.json")  # stored as checkpoint.snap
+LOCKS_DIR = os.path.join(DATA_DIR, "locks")
+
+# Keep a binary snapshot next to each JSON file for fast loading (local backend)
+SNAPSHOT_ENABLED = os.environ.get("SNAPSHOT_ENABLED", "0") == "1"
+
+# Shared state for multi-worker deployments, e.g. redis://host:6379/0.
+# Empty keeps all state in local JSON files (single worker).
+STATE_URL = os.environ.get("STATE_URL", "")
+STATE_KEY_PREFIX = os.environ.get("STATE_KEY_PREFIX", "dataforwarder:")
+LOCK_TTL = 10
+LOCK_RETRY_INTERVAL = 0.05
+BROADCAST_LOCK_TTL = 300
+BROADCAST_BATCH_SIZE = 100
+
+# How long a confirmed force-join membership is trusted before re-checking.
+# Channels that deliver chat_member updates are trusted longer, but still
+# re-checked eventually in case a leave update was missed.
+MEMBERSHIP_CACHE_TTL = int(os.environ.get("MEMBERSHIP_CACHE_TTL", "300"))
+TRACKED_MEMBERSHIP_TTL = int(os.environ.get("TRACKED_MEMBERSHIP_TTL", str(24 * 3600)))
+JOINED_STATUSES = ("member", "administrator", "creator")
+
+# Webhook mode (required to run several workers behind a load balancer)
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+PORT = int(os.environ.get("PORT", "8443"))
+
+# Anti-flood: at most FLOOD_LIMIT updates per user in any FLOOD_WINDOW seconds
+FLOOD_LIMIT = int(os.environ.get("FLOOD_LIMIT", "5"))
+FLOOD_WINDOW = float(os.environ.get("FLOOD_WINDOW", "10"))
+
+# last_seen is only persisted once it moved by more than LAST_SEEN_GRANULARITY
+# seconds, and pending updates are written every LAST_SEEN_FLUSH_INTERVAL seconds
+LAST_SEEN_GRANULARITY = int(os.environ.get("LAST_SEEN_GRANULARITY", "300"))
+LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get("LAST_SEEN_FLUSH_INTERVAL", "60"))
+
+# Users inactive for COLD_AFTER_DAYS are moved from users.json to a compressed
+# cold archive every ARCHIVE_INTERVAL seconds (0 disables tiering)
+COLD_AFTER_DAYS = int(os.environ.get("COLD_AFTER_DAYS", "90"))
+ARCHIVE_INTERVAL = int(os.environ.get("ARCHIVE_INTERVAL", str(6 * 3600)))
+# The archive is a series of gzip members of COLD_CHUNK_SIZE users each, so a
+# returning user is restored by decompressing a single member
+COLD_CHUNK_SIZE = 1000
+COLD_READ_SIZE = 64 * 1024
+
+# Shutdown: how long a running broadcast may go on once the bot is stopping,
+# and how old a cache checkpoint may be to still be restored on the next start
+SHUTDOWN_DRAIN_TIMEOUT = float(os.environ.get("SHUTDOWN_DRAIN_TIMEOUT", "20"))
+CHECKPOINT_MAX_AGE = int(os.environ.get("CHECKPOINT_MAX_AGE", "3600"))
+
+# Event loop monitor: heartbeat interval, stall length after which the loop
+# thread's stack is logged, and the loop lag / pending update counts above
+# which broadcasts and archival pause and polling stops (interval 0 disables)
+LOOP_MONITOR_INTERVAL = float(os.environ.get("LOOP_MONITOR_INTERVAL", "0.5"))
+LOOP_STALL_THRESHOLD = float(os.environ.get("LOOP_STALL_THRESHOLD", "1.0"))
+LOOP_LAG_LIMIT = float(os.environ.get("LOOP_LAG_LIMIT", "0.5"))
+UPDATE_QUEUE_LIMIT = int(os.environ.get("UPDATE_QUEUE_LIMIT", "100"))
+
+# Video list pagination
+VIDEOS_PER_PAGE = 10
+VIDEO_BUTTONS_PER_ROW = 5
+
+# Inline mode: results per answer, how long Telegram may cache an answer, and
+# how many distinct queries keep their matches in the local LRU
+INLINE_PAGE_SIZE = 50
+INLINE_CACHE_TIME = int(os.environ.get("INLINE_CACHE_TIME", "300"))
+INLINE_LRU_SIZE = 512
+# Only these kinds have a cached inline result type; video notes and legacy
+# entries of unknown kind are left out of inline search
+INLINE_KINDS = ("video", "document")
+# Inline queries arrive per keystroke: a failed force-join check is reused
+# for this many seconds instead of asking the Bot API again
+INLINE_NOT_JOINED_TTL = 10
+
+# Deep links: t.me/<bot>?start=v<serial>, signed variants carry an expiry and
+# an HMAC so links can be shared for a limited time only. Without a secret,
+# signed links are neither issued nor accepted.
+DEEPLINK_SECRET = os.environ.get("DEEPLINK_SECRET", "")
+DEEPLINK_SIGNED_ONLY = os.environ.get("DEEPLINK_SIGNED_ONLY", "0") == "1"
+
+# Profiling: longest allowed /profile run and report length
+PROFILE_MAX_SECONDS = 600
+PROFILE_TOP_N = 25
+
+# Opt-in recording of anonymized updates for offline replay (tools/replay.py)
+UPDATE_RECORD_DIR = os.environ.get("UPDATE_RECORD_DIR", "")
+UPDATE_RECORD_MAX_BYTES = int(os.environ.get("UPDATE_RECORD_MAX_BYTES", str(50 * 1024 * 1024)))
+UPDATE_RECORD_SALT = os.environ.get("UPDATE_RECORD_SALT", "") or uuid.uuid4().hex
 
 # Video sync state
 last_sync_message_id = {"message_id": 0}
 
+# User activity state: user_id -> last_seen as known in memory, and
+# user_id -> field updates not yet written to USERS_FILE
+_last_seen_index: Optional[Dict[int, datetime]] = None
+_pending_user_updates: Dict[int, Dict[str, str]] = {}
+# Archived user_id -> byte offset of the gzip member holding its record
+_cold_index: Optional[Dict[int, int]] = None
+
 # Logging Setup
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -51,16 +187,643 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# =============================================================================
+# PROFILING
+# =============================================================================
+
+# Handler profiling is switched on by /profile and costs a single flag check
+# per handler call, API request and storage call while off.
+_profiling_active = False
+_profile_sample_rate = 1.0
+# handler name -> [calls, wall, cpu, api, storage] in seconds
+_profile_stats: Dict[str, List[float]] = {}
+# Samples of all profiled handlers currently running in this context (nested
+# for callback routes inside callback_handler)
+_profile_samples: ContextVar[Tuple[Dict[str, float], ...]] = ContextVar("profile_samples", default=())
+
+
+def _add_profile_time(kind: str, seconds: float):
+    """Attribute time spent on the Bot API or storage to the running handlers."""
+    for sample in _profile_samples.get():
+        sample[kind] += seconds
+
+
+class CPUTimedCoroutine:
+    """Drive a coroutine step by step, adding up the thread CPU time of its own steps.
+    
+    Measuring around the whole await would also count every other coroutine
+    that ran on the loop while this one was suspended.
+    """
+    
+    def __init__(self, coro: Awaitable):
+        self.coro = coro
+        self.cpu = 0.0
+    
+    def __await__(self):
+        value, error = None, None
+        
+        while True:
+            start = time.thread_time()
+            try:
+                if error is None:
+                    signal = self.coro.send(value)
+                else:
+                    signal = self.coro.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.cpu += time.thread_time() - start
+            
+            # Pass whatever the coroutine waits on up to the event loop
+            value, error = None, None
+            try:
+                value = yield signal
+            except BaseException as e:
+                error = e
+
+
+def profiled(callback: Callable, name: Optional[str] = None) -> Callable:
+    """Wrap a handler coroutine to record wall, CPU, API and storage time while profiling."""
+    if getattr(callback, "profiled", False):
+        return callback
+    
+    name = name or callback.__name__
+    
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        if not _profiling_active or random.random() >= _profile_sample_rate:
+            return await callback(*args, **kwargs)
+        
+        sample = {"api": 0.0, "storage": 0.0}
+        token = _profile_samples.set(_profile_samples.get() + (sample,))
+        timed = CPUTimedCoroutine(callback(*args, **kwargs))
+        wall_start = time.perf_counter()
+        
+        try:
+            return await timed
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = timed.cpu
+            _profile_samples.reset(token)
+            
+            stats = _profile_stats.setdefault(name, [0, 0.0, 0.0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += wall
+            stats[2] += cpu
+            stats[3] += sample["api"]
+            stats[4] += sample["storage"]
+    
+    wrapper.profiled = True
+    return wrapper
+
+
+def profiled_storage(func: Callable) -> Callable:
+    """Count time spent in a storage function towards the running handlers."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _profiling_active:
+            return func(*args, **kwargs)
+        
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _add_profile_time("storage", time.perf_counter() - start)
+    
+    return wrapper
+
+
+class ProfiledRequest(HTTPXRequest):
+    """Bot API transport that counts request time towards the running handlers."""
+    
+    async def do_request(self, *args, **kwargs):
+        if not _profiling_active:
+            return await super().do_request(*args, **kwargs)
+        
+        start = time.perf_counter()
+        try:
+            return await super().do_request(*args, **kwargs)
+        finally:
+            _add_profile_time("api", time.perf_counter() - start)
+
+
+def instrument_handlers(application: Application):
+    """Wrap every registered handler and callback route for profiling."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = profiled(handler.callback)
+    
+    for prefix, route in list(CALLBACK_ROUTES.items()):
+        CALLBACK_ROUTES[prefix] = profiled(route, f"callback:{prefix}")
+
+
+def start_profiling(sample_rate: float):
+    """Reset statistics and start sampling handler calls."""
+    global _profiling_active, _profile_sample_rate
+    
+    _profile_stats.clear()
+    _profile_sample_rate = sample_rate
+    _profiling_active = True
+
+
+def stop_profiling(top_n: int = PROFILE_TOP_N) -> str:
+    """Stop sampling and render the hottest handlers as a text report."""
+    global _profiling_active
+    
+    _profiling_active = False
+    
+    rows = sorted(_profile_stats.items(), key=lambda item: item[1][1], reverse=True)[:top_n]
+    
+    lines = [
+        f"Handler profile - sample rate {_profile_sample_rate:g}, top {top_n} by total wall time",
+        "Times in ms. cpu = CPU of the handler's own code while running on the loop.",
+        "other = wall - api - storage (CPU plus any other awaits).",
+        "callback:* rows are also included in callback_handler.",
+        "",
+        f"{'handler':<32}{'calls':>7}{'wall':>10}{'avg':>9}{'cpu':>10}{'api':>10}{'storage':>10}{'other':>10}",
+    ]
+    
+    for name, (calls, wall, cpu, api, storage) in rows:
+        lines.append(
+            f"{name:<32}{int(calls):>7}{wall * 1000:>10.1f}{wall * 1000 / calls:>9.1f}"
+            f"{cpu * 1000:>10.1f}{api * 1000:>10.1f}{storage * 1000:>10.1f}"
+            f"{(wall - api - storage) * 1000:>10.1f}"
+        )
+    
+    if not rows:
+        lines.append("No handler calls were sampled.")
+    
+    return "\n".join(lines) + "\n"
+
+
+# =============================================================================
+# STATE BACKENDS
+# =============================================================================
+
+async def wait_for_lock(lock: Any, timeout: float) -> bool:
+    """Retry a lock until the timeout, sleeping on the event loop in between.
+    
+    Waiting must never block the loop: other workers may hold the lock for a
+    while, and every update of this worker would stall behind it.
+    """
+    deadline = time.monotonic() + timeout
+    
+    while not lock.acquire():
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(LOCK_RETRY_INTERVAL)
+    
+    return True
+
+
+class FileLock:
+    """Cross-process lock on a shared volume using flock()."""
+    
+    def __init__(self, name: str, ttl: float):
+        self.path = os.path.join(LOCKS_DIR, f"{name}.lock")
+        self.ttl = ttl
+        self._file = None
+    
+    def acquire(self) -> bool:
+        """Try to take the lock once, without waiting."""
+        if fcntl is None:
+            return True
+        os.makedirs(LOCKS_DIR, exist_ok=True)
+        self._file = open(self.path, "a+")
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            self._file.close()
+            self._file = None
+            return False
+    
+    def extend(self):
+        """File locks do not expire - nothing to do."""
+    
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+    
+    async def __aenter__(self):
+        if not await wait_for_lock(self, self.ttl):
+            raise TimeoutError(f"Could not acquire lock {self.path}")
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class RedisLock:
+    """Distributed lock: SET NX PX with a random token, released only by its owner."""
+    
+    RELEASE_SCRIPT = (
+        "if redis.call('get', KEYS[1]) == ARGV[1] then "
+        "return redis.call('del', KEYS[1]) else return 0 end"
+    )
+    EXTEND_SCRIPT = (
+        "if redis.call('get', KEYS[1]) == ARGV[1] then "
+        "return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+    )
+    
+    def __init__(self, client: Any, key: str, ttl: float):
+        self.client = client
+        self.key = key
+        self.ttl = ttl
+        self.ttl_ms = int(ttl * 1000)
+        self.token = uuid.uuid4().hex
+    
+    def acquire(self) -> bool:
+        """Try to take the lock once, without waiting."""
+        return bool(self.client.set(self.key, self.token, nx=True, px=self.ttl_ms))
+    
+    def extend(self):
+        self.client.eval(self.EXTEND_SCRIPT, 1, self.key, self.token, self.ttl_ms)
+    
+    def release(self):
+        self.client.eval(self.RELEASE_SCRIPT, 1, self.key, self.token)
+    
+    async def __aenter__(self):
+        if not await wait_for_lock(self, self.ttl):
+            raise TimeoutError(f"Could not acquire lock {self.key}")
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+# Snapshot layout: fixed header followed by a marshal payload. The header pins
+# the marshal and Python versions, since marshal data is not portable across them.
+SNAPSHOT_MAGIC = b"DFSNAP"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<6sBBBBQI")  # magic, version, marshal, py major, py minor, length, crc32
+
+
+def snapshot_path(file_path: str) -> str:
+    """Get the snapshot file belonging to a JSON file."""
+    return os.path.splitext(file_path)[0] + ".snap"
+
+
+def write_snapshot(file_path: str, data: Any):
+    """Write the binary snapshot for a JSON document."""
+    payload = marshal.dumps(data)
+    header = SNAPSHOT_HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, marshal.version,
+        sys.version_info.major, sys.version_info.minor,
+        len(payload), zlib.crc32(payload),
+    )
+    path = snapshot_path(file_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            f.write(payload)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_snapshot(file_path: str) -> Any:
+    """Read the snapshot for a JSON document in one pass.
+    
+    Raises FileNotFoundError if there is no usable snapshot: missing, older
+    than the JSON file, written by another Python version, or corrupt.
+    """
+    path = snapshot_path(file_path)
+    
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    
+    # The JSON file was edited after the snapshot was written
+    if os.path.exists(file_path) and os.stat(path).st_mtime_ns < os.stat(file_path).st_mtime_ns:
+        raise FileNotFoundError(path)
+    
+    with open(path, "rb") as f:
+        raw = f.read()
+    
+    if len(raw) < SNAPSHOT_HEADER.size:
+        raise FileNotFoundError(path)
+    
+    magic, version, marshal_version, major, minor, length, crc = SNAPSHOT_HEADER.unpack_from(raw)
+    payload = memoryview(raw)[SNAPSHOT_HEADER.size:]
+    
+    if (magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION
+            or marshal_version != marshal.version
+            or (major, minor) != sys.version_info[:2]
+            or len(payload) != length or zlib.crc32(payload) != crc):
+        raise FileNotFoundError(path)
+    
+    return marshal.loads(payload)
+
+
+class LocalStateBackend:
+    """JSON documents as files under DATA_DIR (single host, default)."""
+    
+    def load(self, file_path: str) -> Any:
+        if SNAPSHOT_ENABLED:
+            try:
+                return read_snapshot(file_path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                # An unreadable snapshot must never look like an empty document
+                logger.error(f"Error reading snapshot for {file_path}, loading JSON: {e}")
+        
+        with open(file_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        
+        # Convert transparently so the next load skips the JSON parser
+        if SNAPSHOT_ENABLED:
+            try:
+                write_snapshot(file_path, data)
+            except Exception as e:
+                logger.error(f"Error writing snapshot for {file_path}: {e}")
+        
+        return data
+    
+    def save(self, file_path: str, data: Any):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # Write to a temp file and rename so concurrent readers never see a partial file
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, file_path)
+        
+        # The JSON file is committed; a stale snapshot is ignored on load
+        if SNAPSHOT_ENABLED:
+            try:
+                write_snapshot(file_path, data)
+            except Exception as e:
+                logger.error(f"Error writing snapshot for {file_path}: {e}")
+    
+    def lock(self, name: str, ttl: float) -> FileLock:
+        return FileLock(name, ttl)
+
+
+class RedisStateBackend:
+    """JSON documents as Redis keys, shared by all workers."""
+    
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("STATE_URL is set but the redis package is not installed")
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = STATE_KEY_PREFIX
+    
+    def _key(self, file_path: str) -> str:
+        return f"{self.prefix}doc:{os.path.basename(file_path)}"
+    
+    def load(self, file_path: str) -> Any:
+        raw = self.client.get(self._key(file_path))
+        if raw is not None:
+            return json.loads(raw)
+        
+        # First run against an empty store: seed it from the local file
+        data = LocalStateBackend().load(file_path)
+        self.client.set(self._key(file_path), json.dumps(data, ensure_ascii=False), nx=True)
+        return data
+    
+    def save(self, file_path: str, data: Any):
+        self.client.set(self._key(file_path), json.dumps(data, ensure_ascii=False))
+    
+    def lock(self, name: str, ttl: float) -> RedisLock:
+        return RedisLock(self.client, f"{self.prefix}lock:{name}", ttl)
+
+
+_state_backend = None
+
+
+def get_state_backend():
+    """Get the configured state backend, creating it on first use."""
+    global _state_backend
+    
+    if _state_backend is None:
+        if STATE_URL:
+            _state_backend = RedisStateBackend(STATE_URL)
+            logger.info("Using shared Redis state backend")
+        else:
+            _state_backend = LocalStateBackend()
+    
+    return _state_backend
+
+
+def state_lock(name: str, ttl: float = LOCK_TTL):
+    """Get a lock shared by all workers using the same state backend."""
+    return get_state_backend().lock(name, ttl)
+
+
+# =============================================================================
+# CACHE ADAPTER
+# =============================================================================
+
+class MemoryPipeline:
+    """Queue cache calls and run them together, like a redis-py pipeline."""
+    
+    def __init__(self, cache: "MemoryCache"):
+        self._cache = cache
+        self._calls = []
+    
+    def __getattr__(self, name: str):
+        method = getattr(self._cache, name)
+        
+        def queue(*args, **kwargs):
+            self._calls.append((method, args, kwargs))
+            return self
+        
+        return queue
+    
+    def execute(self) -> List[Any]:
+        calls, self._calls = self._calls, []
+        return [method(*args, **kwargs) for method, args, kwargs in calls]
+
+
+class MemoryCache:
+    """In-process cache implementing the subset of the redis-py client API the
+    bot uses, so a redis.Redis client (decode_responses=True) can be used in
+    its place unchanged.
+    """
+    
+    def __init__(self):
+        self._data: Dict[str, Any] = {}
+        self._expires: Dict[str, float] = {}
+    
+    def _live(self, key: str) -> Any:
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(key, None)
+            del self._expires[key]
+        return self._data.get(key)
+    
+    def get(self, key: str) -> Optional[str]:
+        value = self._live(key)
+        return value if isinstance(value, str) else None
+    
+    def set(self, key: str, value: Any, ex: Optional[float] = None, nx: bool = False) -> Optional[bool]:
+        if nx and self._live(key) is not None:
+            return None
+        self._data[key] = str(value)
+        if ex is None:
+            self._expires.pop(key, None)
+        else:
+            self._expires[key] = time.monotonic() + ex
+        return True
+    
+    def delete(self, *keys: str) -> int:
+        deleted = 0
+        for key in keys:
+            if self._live(key) is not None:
+                deleted += 1
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return deleted
+    
+    def exists(self, *keys: str) -> int:
+        return sum(1 for key in keys if self._live(key) is not None)
+    
+    def expire(self, key: str, seconds: float) -> bool:
+        if self._live(key) is None:
+            return False
+        self._expires[key] = time.monotonic() + seconds
+        return True
+    
+    def incr(self, key: str, amount: int = 1) -> int:
+        value = int(self.get(key) or 0) + amount
+        self._data[key] = str(value)
+        return value
+    
+    def sadd(self, key: str, *members: Any) -> int:
+        members_set = self._live(key)
+        if members_set is None:
+            members_set = self._data[key] = set()
+        before = len(members_set)
+        members_set.update(str(member) for member in members)
+        return len(members_set) - before
+    
+    def srem(self, key: str, *members: Any) -> int:
+        members_set = self._live(key) or set()
+        before = len(members_set)
+        members_set.difference_update(str(member) for member in members)
+        return before - len(members_set)
+    
+    def scard(self, key: str) -> int:
+        return len(self._live(key) or ())
+    
+    def sismember(self, key: str, member: Any) -> bool:
+        return str(member) in (self._live(key) or ())
+    
+    def smembers(self, key: str) -> set:
+        return set(self._live(key) or ())
+    
+    def hset(self, key: str, field: Optional[str] = None, value: Any = None,
+             mapping: Optional[Dict[str, Any]] = None) -> int:
+        fields = self._live(key)
+        if fields is None:
+            fields = self._data[key] = {}
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        added = sum(1 for name in items if name not in fields)
+        fields.update((name, str(item)) for name, item in items.items())
+        return added
+    
+    def persist(self, key: str) -> bool:
+        return self._expires.pop(key, None) is not None
+    
+    def hgetall(self, key: str) -> Dict[str, str]:
+        return dict(self._live(key) or {})
+    
+    def hdel(self, key: str, *fields: str) -> int:
+        values = self._live(key) or {}
+        return sum(1 for name in fields if values.pop(name, None) is not None)
+    
+    def pipeline(self, transaction: bool = True) -> MemoryPipeline:
+        return MemoryPipeline(self)
+    
+    def export(self, skip_prefix: str = "") -> Dict[str, Tuple[Any, Optional[float]]]:
+        """Dump live entries as key -> (value, wall clock expiry or None)."""
+        now_wall, now_mono = time.time(), time.monotonic()
+        entries = {}
+        for key in list(self._data):
+            value = self._live(key)
+            if value is None or (skip_prefix and key.startswith(skip_prefix)):
+                continue
+            expires = self._expires.get(key)
+            entries[key] = (value, None if expires is None else now_wall + expires - now_mono)
+        return entries
+    
+    def restore(self, entries: Dict[str, Tuple[Any, Optional[float]]]):
+        """Load entries produced by export(), dropping those that expired meanwhile."""
+        now_wall, now_mono = time.time(), time.monotonic()
+        for key, (value, expires) in entries.items():
+            if expires is not None and expires <= now_wall:
+                continue
+            self._data[key] = value
+            if expires is None:
+                self._expires.pop(key, None)
+            else:
+                self._expires[key] = now_mono + expires - now_wall
+
+
+_cache = None
+
+
+def get_cache():
+    """Get the shared cache: the Redis client when STATE_URL is set, else in-process."""
+    global _cache
+    
+    if _cache is None:
+        backend = get_state_backend()
+        _cache = backend.client if isinstance(backend, RedisStateBackend) else MemoryCache()
+    
+    return _cache
+
+
+def cache_key(*parts: Any) -> str:
+    """Build a namespaced cache key."""
+    return STATE_KEY_PREFIX + ":".join(str(part) for part in parts)
+
+
+# Set indexes mirroring the JSON documents, rebuilt from them when missing:
+# name -> loader returning the normalized members
+INDEX_LOADERS: Dict[str, Callable[[], List[str]]] = {}
+_ready_indexes: set = set()
+
+
+def ensure_index(name: str) -> str:
+    """Make sure the cached set index exists and return its key."""
+    key = cache_key("idx", name)
+    
+    if name in _ready_indexes:
+        return key
+    
+    cache = get_cache()
+    ready_key = cache_key("idx", name, "ready")
+    
+    if not cache.exists(ready_key):
+        members = INDEX_LOADERS[name]()
+        pipe = cache.pipeline(transaction=False)
+        pipe.delete(key)
+        if members:
+            pipe.sadd(key, *members)
+        pipe.set(ready_key, "1")
+        pipe.execute()
+    
+    _ready_indexes.add(name)
+    return key
+
+
 # =============================================================================
 # JSON STORAGE FUNCTIONS
 # =============================================================================
 
+@profiled_storage
 def load_json(file_path: str, default: Any = None) -> Any:
-    """Load JSON data from file with error handling."""
+    """Load JSON data from the state backend with error handling."""
     try:
-        if os.path.exists(file_path):
-            with open(file_path, "r", encoding="utf-8") as f:
-                return json.load(f)
+        return get_state_backend().load(file_path)
+    except FileNotFoundError:
         return default if default is not None else []
     except json.JSONDecodeError as e:
         logger.error(f"JSON decode error in {file_path}: {e}")
@@ -70,12 +833,11 @@ def load_json(file_path: str, default: Any = None) -> Any:
         return default if default is not None else []
 
 
+@profiled_storage
 def save_json(file_path: str, data: Any) -> bool:
-    """Save JSON data to file with error handling."""
+    """Save JSON data to the state backend with error handling."""
     try:
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+        get_state_backend().save(file_path, data)
         return True
     except Exception as e:
         logger.error(f"Error saving {file_path}: {e}")
@@ -83,31 +845,382 @@ def save_json(file_path: str, data: Any) -> bool:
 
 
 def get_users() -> List[Dict]:
-    """Get all users."""
+    """Get all hot (recently active) users. See iter_all_users() for everyone."""
     return load_json(USERS_FILE, [])
 
 
-def save_user(user_id: int, username: str = "", first_name: str = "") -> bool:
-    """Save or update user in database."""
-    users = get_users()
-    user_id_str = str(user_id)
+def _parse_timestamp(value: Any) -> datetime:
+    """Parse a stored ISO timestamp, falling back to the epoch."""
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return datetime.min
+
+
+def _get_last_seen_index() -> Dict[int, datetime]:
+    """Get the in-memory user_id -> last_seen index, loading it on first use."""
+    global _last_seen_index
     
-    for user in users:
-        if str(user.get("id")) == user_id_str:
+    if _last_seen_index is None:
+        _last_seen_index = {}
+        for user in get_users():
+            try:
+                _last_seen_index[int(user["id"])] = _parse_timestamp(user.get("last_seen"))
+            except (KeyError, TypeError, ValueError):
+                continue
+    
+    return _last_seen_index
+
+
+async def save_user(user_id: int, username: str = "", first_name: str = "") -> bool:
+    """Save or update user in database.
+    
+    New users are written immediately. For known users the update is kept in
+    memory and persisted by flush_user_updates(), and only once last_seen has
+    moved by more than LAST_SEEN_GRANULARITY seconds.
+    """
+    index = _get_last_seen_index()
+    user_id = int(user_id)
+    now = datetime.now()
+    
+    if user_id in index:
+        if (now - index[user_id]).total_seconds() < LAST_SEEN_GRANULARITY:
+            return True
+        
+        index[user_id] = now
+        pending = _pending_user_updates.setdefault(user_id, {})
+        pending["last_seen"] = now.isoformat()
+        if username:
+            pending["username"] = username
+        if first_name:
+            pending["first_name"] = first_name
+        return True
+    
+    async with state_lock("users"):
+        users = get_users()
+        user_id_str = str(user_id)
+        
+        for user in users:
+            if str(user.get("id")) == user_id_str:
+                user["username"] = username or user.get("username", "")
+                user["first_name"] = first_name or user.get("first_name", "")
+                user["last_seen"] = now.isoformat()
+                break
+        else:
+            # Returning archived users keep their original record
+            user = _restore_cold_user(user_id) or {
+                "id": user_id,
+                "joined": now.isoformat(),
+            }
             user["username"] = username or user.get("username", "")
             user["first_name"] = first_name or user.get("first_name", "")
-            user["last_seen"] = datetime.now().isoformat()
-            break
-    else:
-        users.append({
-            "id": user_id,
-            "username": username,
-            "first_name": first_name,
-            "joined": datetime.now().isoformat(),
-            "last_seen": datetime.now().isoformat(),
-        })
+            user["last_seen"] = now.isoformat()
+            users.append(user)
+        
+        index[user_id] = now
+        return save_json(USERS_FILE, users)
+
+
+async def flush_user_updates() -> bool:
+    """Persist pending last_seen/profile updates in one write."""
+    global _pending_user_updates
+    
+    if not _pending_user_updates:
+        return True
+    
+    async with state_lock("users"):
+        pending, _pending_user_updates = _pending_user_updates, {}
+        users = get_users()
+        
+        for user in users:
+            try:
+                updates = pending.get(int(user.get("id")))
+            except (TypeError, ValueError):
+                continue
+            if updates:
+                user.update(updates)
+        
+        if save_json(USERS_FILE, users):
+            logger.info(f"Flushed last_seen updates for {len(pending)} users")
+            return True
+        
+        # Keep the batch for the next attempt, newer updates win
+        for user_id, updates in pending.items():
+            _pending_user_updates[user_id] = {**updates, **_pending_user_updates.get(user_id, {})}
+        return False
+
+
+def tiering_enabled() -> bool:
+    """Cold archiving needs local files, so it is off with a shared state backend."""
+    return COLD_AFTER_DAYS > 0 and isinstance(get_state_backend(), LocalStateBackend)
+
+
+def _read_cold_users():
+    """Stream all records from the cold archive, one JSON line at a time."""
+    if not os.path.exists(COLD_USERS_FILE):
+        return
+    
+    with gzip.open(COLD_USERS_FILE, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _read_cold_members(offset: int = 0, first_only: bool = False) -> Iterator[Tuple[int, bytes]]:
+    """Stream (member offset, JSON line) pairs from the cold archive, starting at offset."""
+    if not os.path.exists(COLD_USERS_FILE):
+        return
+    
+    with open(COLD_USERS_FILE, "rb") as f:
+        f.seek(offset)
+        data = f.read(COLD_READ_SIZE)
+        
+        while data:
+            decompressor = zlib.decompressobj(wbits=31)  # gzip framing
+            member_offset, tail = offset, b""
+            
+            while True:
+                lines = (tail + decompressor.decompress(data)).split(b"\n")
+                tail = lines.pop()
+                for line in lines:
+                    if line.strip():
+                        yield member_offset, line
+                
+                if decompressor.eof:
+                    offset += len(data) - len(decompressor.unused_data)
+                    data = decompressor.unused_data or f.read(COLD_READ_SIZE)
+                    break
+                
+                offset += len(data)
+                data = f.read(COLD_READ_SIZE)
+                if not data:
+                    raise EOFError(f"{COLD_USERS_FILE} is truncated")
+            
+            if tail.strip():
+                yield member_offset, tail
+            if first_only:
+                return
+
+
+def _write_cold_archive(path: str, users: Iterable[Dict]) -> Dict[int, int]:
+    """Write users as gzip members of COLD_CHUNK_SIZE records, returning the offset index."""
+    index = {}
+    
+    with open(path, "wb") as f:
+        for chunk in iter(lambda: list(itertools.islice(users, COLD_CHUNK_SIZE)), []):
+            offset = f.tell()
+            lines = "".join(json.dumps(user, ensure_ascii=False) + "\n" for user in chunk)
+            f.write(gzip.compress(lines.encode("utf-8")))
+            for user in chunk:
+                index[int(user["id"])] = offset
     
-    return save_json(USERS_FILE, users)
+    return index
+
+
+def _get_cold_index() -> Dict[int, int]:
+    """Get the archived user_id -> member offset index, scanning the archive on first use.
+    
+    A damaged archive is indexed up to the damage, so registrations keep working.
+    """
+    global _cold_index
+    
+    if _cold_index is None:
+        hot_ids = _get_last_seen_index()
+        index = {}
+        if tiering_enabled():
+            try:
+                for offset, line in _read_cold_members():
+                    user_id = int(json.loads(line)["id"])
+                    if user_id not in hot_ids:
+                        index[user_id] = offset
+            except Exception as e:
+                logger.error(f"Error indexing {COLD_USERS_FILE}, {len(index)} archived users indexed: {e}")
+        _cold_index = index
+    
+    return _cold_index
+
+
+def iter_cold_users():
+    """Stream archived users from disk, skipping users that have since returned."""
+    hot_ids = _get_last_seen_index()
+    
+    for user in _read_cold_users():
+        if int(user["id"]) not in hot_ids:
+            yield user
+
+
+def iter_all_users():
+    """Yield hot users, then stream the cold archive without loading it whole."""
+    yield from get_users()
+    yield from iter_cold_users()
+
+
+def count_cold_users() -> int:
+    """Number of users in the cold archive."""
+    return len(_get_cold_index())
+
+
+def _restore_cold_user(user_id: int) -> Optional[Dict]:
+    """Find an archived user record for a returning user, reading only its gzip member."""
+    index = _get_cold_index()
+    offset = index.get(user_id)
+    
+    if offset is None:
+        return None
+    
+    try:
+        for _, line in _read_cold_members(offset, first_only=True):
+            user = json.loads(line)
+            if int(user["id"]) == user_id:
+                del index[user_id]
+                logger.info(f"Restored user {user_id} from the cold archive")
+                return user
+    except Exception as e:
+        # The user starts over with a fresh record rather than not at all
+        logger.error(f"Error restoring user {user_id} from {COLD_USERS_FILE}: {e}")
+        index.pop(user_id, None)
+    
+    return None
+
+
+async def archive_inactive_users() -> int:
+    """Move users inactive for COLD_AFTER_DAYS from the hot set to the cold archive.
+    
+    The archive is rewritten as a whole, dropping stale copies of users that
+    came back, and written before the hot file so a crash in between leaves
+    the user in both tiers (hot wins) rather than in neither. Rewriting also
+    splits archives written as a single gzip member into chunks.
+    """
+    global _cold_index
+    
+    if not tiering_enabled():
+        return 0
+    
+    await flush_user_updates()
+    cutoff = datetime.now() - timedelta(days=COLD_AFTER_DAYS)
+    
+    async with state_lock("users"):
+        users = get_users()
+        hot, cold = [], []
+        for user in users:
+            (cold if _parse_timestamp(user.get("last_seen")) < cutoff else hot).append(user)
+        
+        if not cold:
+            return 0
+        
+        hot_ids = {int(user["id"]) for user in hot}
+        cold_ids = {int(user["id"]) for user in cold}
+        tmp_path = f"{COLD_USERS_FILE}.{os.getpid()}.tmp"
+        
+        kept = (
+            user for user in _read_cold_users()
+            if int(user["id"]) not in hot_ids and int(user["id"]) not in cold_ids
+        )
+        cold_index = _write_cold_archive(tmp_path, itertools.chain(kept, cold))
+        os.replace(tmp_path, COLD_USERS_FILE)
+        
+        if not save_json(USERS_FILE, hot):
+            # Users are in both tiers now; rescan so the hot copies win
+            _cold_index = None
+            return 0
+        
+        _cold_index = cold_index
+        index = _get_last_seen_index()
+        for user_id in cold_ids:
+            index.pop(user_id, None)
+    
+    logger.info(f"Archived {len(cold)} inactive users, {len(hot)} remain hot")
+    return len(cold)
+
+
+def mark_user_verified(user_id: int):
+    """Remember that a user entered a valid access code, written with the next flush."""
+    _pending_user_updates.setdefault(int(user_id), {})["verified"] = True
+
+
+# =============================================================================
+# BROADCAST SEGMENTS
+# =============================================================================
+
+# Segment filters: active=<days> since=<YYYY-MM-DD> verified=<yes|no> ids=<from>-<to>
+
+def parse_broadcast_args(args: List[str]) -> Tuple[Dict[str, Any], List[str]]:
+    """Split leading key=value segment filters from the broadcast message words."""
+    segment: Dict[str, Any] = {}
+    rest = list(args)
+    
+    while rest and "=" in rest[0]:
+        key, _, value = rest.pop(0).partition("=")
+        key = key.lower()
+        
+        if key == "active":
+            segment["active_days"] = int(value)
+        elif key == "since":
+            segment["joined_after"] = datetime.fromisoformat(value)
+        elif key == "verified":
+            segment["verified"] = value.lower() in ("1", "yes", "true")
+        elif key == "ids":
+            low, _, high = value.partition("-")
+            segment["id_range"] = (int(low), int(high or low))
+        else:
+            raise ValueError(f"Unknown segment filter: {key}")
+    
+    return segment, rest
+
+
+def describe_segment(segment: Dict[str, Any]) -> str:
+    """Human readable summary of a segment."""
+    parts = []
+    if "active_days" in segment:
+        parts.append(f"active in the last {segment['active_days']} days")
+    if "joined_after" in segment:
+        parts.append(f"joined since {segment['joined_after']:%Y-%m-%d}")
+    if "verified" in segment:
+        parts.append("code-verified" if segment["verified"] else "not code-verified")
+    if "id_range" in segment:
+        parts.append(f"ids {segment['id_range'][0]}-{segment['id_range'][1]}")
+    return ", ".join(parts) or "all users"
+
+
+def matches_segment(user: Dict, segment: Dict[str, Any], now: datetime) -> bool:
+    """Check a single user record against every filter of a segment."""
+    if "active_days" in segment:
+        if _parse_timestamp(user.get("last_seen")) < now - timedelta(days=segment["active_days"]):
+            return False
+    if "joined_after" in segment:
+        if _parse_timestamp(user.get("joined")) < segment["joined_after"]:
+            return False
+    if "verified" in segment:
+        if bool(user.get("verified")) != segment["verified"]:
+            return False
+    if "id_range" in segment:
+        low, high = segment["id_range"]
+        if not low <= int(user["id"]) <= high:
+            return False
+    return True
+
+
+def iter_segment_batches(segment: Dict[str, Any], batch_size: int = BROADCAST_BATCH_SIZE) -> Iterator[List[int]]:
+    """Yield the ids of a segment in batches, filtering hot users and then the streamed cold archive."""
+    now = datetime.now()
+    batch: List[int] = []
+    
+    users: Iterable[Dict] = get_users()
+    
+    # Archived users were inactive for COLD_AFTER_DAYS, so short activity windows skip the archive
+    if "active_days" not in segment or segment["active_days"] >= COLD_AFTER_DAYS:
+        users = itertools.chain(users, iter_cold_users())
+    
+    for user in users:
+        if not matches_segment(user, segment, now):
+            continue
+        batch.append(int(user["id"]))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    
+    if batch:
+        yield batch
 
 
 def get_codes() -> List[Dict]:
@@ -115,32 +1228,31 @@ def get_codes() -> List[Dict]:
     return load_json(CODES_FILE, [])
 
 
-def add_code(code: str) -> bool:
+async def add_code(code: str) -> bool:
     """Add access code."""
-    codes = get_codes()
-    code_lower = code.lower().strip()
-    
-    for c in codes:
-        if c.get("code", "").lower() == code_lower:
+    async with state_lock("codes"):
+        codes = get_codes()
+        code_lower = code.lower().strip()
+        
+        for c in codes:
+            if c.get("code", "").lower() == code_lower:
+                return False
+        
+        codes.append({
+            "code": code,
+            "created": datetime.now().isoformat(),
+        })
+        
+        if not save_json(CODES_FILE, codes):
             return False
-    
-    codes.append({
-        "code": code,
-        "created": datetime.now().isoformat(),
-    })
-    
-    return save_json(CODES_FILE, codes)
+        
+        get_cache().sadd(ensure_index("codes"), code_lower)
+        return True
 
 
 def check_code(code: str) -> bool:
     """Check if access code is valid."""
-    codes = get_codes()
-    code_lower = code.lower().strip()
-    
-    for c in codes:
-        if c.get("code", "").lower() == code_lower:
-            return True
-    return False
+    return bool(get_cache().sismember(ensure_index("codes"), code.lower().strip()))
 
 
 def get_force_channels() -> List[Dict]:
@@ -148,32 +1260,42 @@ def get_force_channels() -> List[Dict]:
     return load_json(FORCE_FILE, [])
 
 
-def add_force_channel(channel: str) -> bool:
+async def add_force_channel(channel: str) -> bool:
     """Add force join channel."""
-    channels = get_force_channels()
-    channel_clean = channel.strip().replace("@", "").lower()
-    
-    for ch in channels:
-        if ch.get("channel", "").replace("@", "").lower() == channel_clean:
+    async with state_lock("force"):
+        channels = get_force_channels()
+        channel_clean = channel.strip().replace("@", "").lower()
+        
+        for ch in channels:
+            if ch.get("channel", "").replace("@", "").lower() == channel_clean:
+                return False
+        
+        channels.append({
+            "channel": channel,
+            "added": datetime.now().isoformat(),
+        })
+        
+        if not save_json(FORCE_FILE, channels):
             return False
-    
-    channels.append({
-        "channel": channel,
-        "added": datetime.now().isoformat(),
-    })
-    
-    return save_json(FORCE_FILE, channels)
+        
+        get_cache().sadd(ensure_index("force"), channel_clean)
+        return True
 
 
-def remove_force_channel(channel: str) -> bool:
+async def remove_force_channel(channel: str) -> bool:
     """Remove force join channel."""
-    channels = get_force_channels()
-    channel_clean = channel.strip().replace("@", "").lower()
-    
-    channels = [ch for ch in channels 
-                if ch.get("channel", "").replace("@", "").lower() != channel_clean]
-    
-    return save_json(FORCE_FILE, channels)
+    async with state_lock("force"):
+        channels = get_force_channels()
+        channel_clean = channel.strip().replace("@", "").lower()
+        
+        channels = [ch for ch in channels 
+                    if ch.get("channel", "").replace("@", "").lower() != channel_clean]
+        
+        if not save_json(FORCE_FILE, channels):
+            return False
+        
+        get_cache().srem(ensure_index("force"), channel_clean)
+        return True
 
 
 def get_admins() -> List[int]:
@@ -181,22 +1303,35 @@ def get_admins() -> List[int]:
     return load_json(ADMINS_FILE, [])
 
 
-def add_admin(user_id: int) -> bool:
+async def add_admin(user_id: int) -> bool:
     """Add admin user."""
-    admins = get_admins()
-    user_id_int = int(user_id)
-    
-    if user_id_int not in admins:
+    async with state_lock("admins"):
+        admins = get_admins()
+        user_id_int = int(user_id)
+        
+        if user_id_int in admins:
+            return False
+        
         admins.append(user_id_int)
-        return save_json(ADMINS_FILE, admins)
-    return False
+        if not save_json(ADMINS_FILE, admins):
+            return False
+        
+        get_cache().sadd(ensure_index("admins"), user_id_int)
+        return True
 
 
 def is_admin(user_id: int) -> bool:
     """Check if user is admin."""
-    admin_ids = [int(ADMIN_ID)] if ADMIN_ID else []
-    admin_ids.extend(get_admins())
-    return int(user_id) in admin_ids
+    if ADMIN_ID and str(user_id) == str(ADMIN_ID):
+        return True
+    return bool(get_cache().sismember(ensure_index("admins"), int(user_id)))
+
+
+INDEX_LOADERS.update({
+    "admins": lambda: [str(int(admin_id)) for admin_id in get_admins()],
+    "codes": lambda: [c.get("code", "").lower().strip() for c in get_codes()],
+    "force": lambda: [ch.get("channel", "").strip().replace("@", "").lower() for ch in get_force_channels()],
+})
 
 
 def get_videos() -> Dict[int, Dict]:
@@ -204,32 +1339,118 @@ def get_videos() -> Dict[int, Dict]:
     return load_json(VIDEOS_FILE, {})
 
 
-def save_video(serial: int, file_id: str, caption: str = "") -> bool:
-    """Save video information."""
-    videos = get_videos()
-    videos[serial] = {
-        "file_id": file_id,
-        "caption": caption,
-        "added": datetime.now().isoformat(),
-    }
-    return save_json(VIDEOS_FILE, videos)
+def get_video(serial: int) -> Optional[Dict]:
+    """Get a single video by serial number from the cached catalogue."""
+    return get_video_catalog().get(int(serial))
+
+
+async def add_video(file_id: str, caption: str = "", kind: str = "video") -> Optional[int]:
+    """Save a video under the next free serial number.
+    
+    Allocation happens under the shared "videos" lock so concurrent workers
+    never hand out the same serial. Returns the serial, or None on failure.
+    """
+    async with state_lock("videos"):
+        videos = get_videos()
+        serial = max((int(key) for key in videos), default=0) + 1
+        videos[str(serial)] = {
+            "file_id": file_id,
+            "caption": caption,
+            "kind": kind,
+            "added": datetime.now().isoformat(),
+        }
+        if not save_json(VIDEOS_FILE, videos):
+            return None
+    
+    # Invalidates the video catalogue and search results of every worker
+    get_cache().incr(cache_key("videos", "version"))
+    return serial
+
+
+def video_kind(video: Dict) -> str:
+    """Kind of a stored video: "video", "video_note", "document", or "" if unknown.
+    
+    Entries saved before kinds were recorded have none; video notes among them
+    are recognizable by the fixed caption they were saved with.
+    """
+    if "kind" in video:
+        return video["kind"]
+    return "video_note" if video.get("caption") == "Video Note" else ""
+
+
+# Parsed video catalogue (serial -> video) and the catalogue version it belongs to
+_video_catalog: Dict[int, Dict] = {}
+_video_catalog_version: Optional[str] = None
+
+
+def get_video_catalog() -> Dict[int, Dict]:
+    """Get all videos keyed by int serial, reloaded only when a video was added."""
+    global _video_catalog, _video_catalog_version
+    
+    version = get_cache().get(cache_key("videos", "version")) or "0"
+    
+    if version != _video_catalog_version:
+        _video_catalog = {int(serial): video for serial, video in get_videos().items()}
+        _video_catalog_version = version
+    
+    return _video_catalog
 
 
 # =============================================================================
 # FORCE JOIN FUNCTIONS
 # =============================================================================
 
-async def check_force_join(update: Update, user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
-    """Check if user has joined all required channels."""
-    channels = get_force_channels()
+async def check_force_join(update: Update, user_id: int, context: ContextTypes.DEFAULT_TYPE,
+                           retry_payload: str = "") -> bool:
+    """Check if user has joined all required channels, showing the join keyboard if not.
+    
+    retry_payload is carried by the "check again" button, e.g. a deep link
+    to deliver once access is granted.
+    """
+    not_joined = await get_unjoined_channels(user_id, context)
+    
+    if not_joined:
+        await show_force_join_keyboard(update, context, not_joined, retry_payload)
+        return False
+    
+    return True
+
+
+async def get_unjoined_channels(user_id: int, context: ContextTypes.DEFAULT_TYPE,
+                                not_joined_ttl: int = 0) -> List[str]:
+    """Get the force channels the user has not joined.
+    
+    The channel list, the channels tracked through chat_member updates and
+    the user's known memberships come from the cache in one pipelined round
+    trip; only channels without a known membership are checked with the Bot API.
+    With not_joined_ttl, a negative answer is cached and reused for that long.
+    """
+    cache = get_cache()
+    membership_key = cache_key("fj", user_id)
+    not_joined_key = cache_key("fj", user_id, "missing")
+    
+    pipe = cache.pipeline(transaction=False)
+    pipe.smembers(ensure_index("force"))
+    pipe.smembers(cache_key("fj", "tracked"))
+    pipe.hgetall(membership_key)
+    pipe.get(not_joined_key)
+    channels, tracked, confirmed, cached_not_joined = pipe.execute()
     
     if not channels:
-        return True
+        return []
+    
+    if not_joined_ttl and cached_not_joined:
+        return cached_not_joined.split(",")
     
+    now = time.time()
     not_joined = []
+    newly_confirmed = {}
     
-    for channel in channels:
-        channel_username = channel.get("channel", "").strip("@").lower()
+    for channel_username in sorted(channels):
+        # Known memberships are stored as channel -> expiry timestamp. Anything
+        # further out (e.g. "inf" from older versions) is re-checked.
+        if now < float(confirmed.get(channel_username, 0)) <= now + TRACKED_MEMBERSHIP_TTL:
+            continue
         
         try:
             # Try to get chat member
@@ -238,21 +1459,68 @@ async def check_force_join(update: Update, user_id: int, context: ContextTypes.D
                 user_id=user_id
             )
             
-            if chat_member.status not in ["member", "administrator", "creator"]:
+            if chat_member.status not in JOINED_STATUSES:
                 not_joined.append(channel_username)
+            elif channel_username in tracked:
+                newly_confirmed[channel_username] = now + TRACKED_MEMBERSHIP_TTL
+            else:
+                newly_confirmed[channel_username] = now + MEMBERSHIP_CACHE_TTL
                 
         except Exception as e:
             logger.error(f"Error checking channel {channel_username}: {e}")
             not_joined.append(channel_username)
     
-    if not_joined:
-        await show_force_join_keyboard(update, context, not_joined)
-        return False
+    if newly_confirmed:
+        pipe = cache.pipeline(transaction=False)
+        pipe.hset(membership_key, mapping=newly_confirmed)
+        # Keep the hash until its longest-lived entry expires
+        expiries = [min(float(expiry), now + TRACKED_MEMBERSHIP_TTL) for expiry in confirmed.values()]
+        expiries += newly_confirmed.values()
+        pipe.expire(membership_key, int(max(expiries) - now) + 1)
+        pipe.execute()
     
-    return True
+    if not_joined_ttl and not_joined:
+        cache.set(not_joined_key, ",".join(not_joined), ex=not_joined_ttl)
+    
+    return not_joined
+
+
+async def track_channel_membership(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Keep the membership index in sync from chat_member updates of force channels.
+    
+    Telegram only sends these to channel admins, which the bot is required to
+    be in force channels. A join of a known bot user is trusted for
+    TRACKED_MEMBERSHIP_TTL, a leave is removed immediately.
+    """
+    member_update = update.chat_member
+    
+    if not member_update or not member_update.chat.username:
+        return
+    
+    channel_username = member_update.chat.username.lower()
+    cache = get_cache()
+    
+    if not cache.sismember(ensure_index("force"), channel_username):
+        return
+    
+    new_member = member_update.new_chat_member
+    user_id = new_member.user.id
+    membership_key = cache_key("fj", user_id)
+    
+    pipe = cache.pipeline(transaction=False)
+    pipe.sadd(cache_key("fj", "tracked"), channel_username)
+    if new_member.status in JOINED_STATUSES:
+        # Channel members who never used the bot are not worth caching
+        if user_id in _get_last_seen_index() or user_id in _get_cold_index():
+            pipe.hset(membership_key, channel_username, time.time() + TRACKED_MEMBERSHIP_TTL)
+            pipe.expire(membership_key, TRACKED_MEMBERSHIP_TTL)
+    else:
+        pipe.hdel(membership_key, channel_username)
+    pipe.execute()
 
 
-async def show_force_join_keyboard(update: Update, context: ContextTypes.DEFAULT_TYPE, channels: List[str]):
+async def show_force_join_keyboard(update: Update, context: ContextTypes.DEFAULT_TYPE, channels: List[str],
+                                   retry_payload: str = ""):
     """Show inline keyboard for force join."""
     keyboard = []
     
@@ -261,7 +1529,14 @@ async def show_force_join_keyboard(update: Update, context: ContextTypes.DEFAULT
             InlineKeyboardButton(f"✅ Join @{channel}", url=f"https://t.me/{channel}")
         ])
     
-    keyboard.append([InlineKeyboardButton("🔄 I Joined - Check Again", callback_data="check_join")])
+    retry_data = "check_join"
+    if retry_payload:
+        try:
+            retry_data = encode_callback("check_join", retry_payload)
+        except ValueError:
+            # Too long for callback data; the user can open the link again after joining
+            logger.warning(f"Dropping deep link payload from join keyboard: {retry_payload}")
+    keyboard.append([InlineKeyboardButton("🔄 I Joined - Check Again", callback_data=retry_data)])
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -279,6 +1554,475 @@ async def show_force_join_keyboard(update: Update, context: ContextTypes.DEFAULT
         await update.callback_query.edit_message_text(text, reply_markup=reply_markup, parse_mode="HTML")
 
 
+# =============================================================================
+# DEEP LINKS
+# =============================================================================
+
+def _sign_video_link(body: str) -> str:
+    """Signature for a deep link body such as "v12_lx3k9a"."""
+    return hmac.new(DEEPLINK_SECRET.encode(), body.encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def make_video_payload(serial: int, ttl_seconds: Optional[int] = None) -> Optional[str]:
+    """Build a /start payload for a video: v<serial>, or v<serial>_<expiry>_<sig> when signed.
+    
+    Returns None if a signed link is needed but DEEPLINK_SECRET is not set.
+    """
+    if ttl_seconds is None and not DEEPLINK_SIGNED_ONLY:
+        return f"v{serial}"
+    
+    if not DEEPLINK_SECRET:
+        return None
+    
+    # Base36 expiry keeps the payload well under Telegram's 64 character limit
+    expires = int(time.time()) + (ttl_seconds or 365 * 24 * 3600)
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    encoded = ""
+    while expires:
+        expires, remainder = divmod(expires, 36)
+        encoded = digits[remainder] + encoded
+    
+    body = f"v{serial}_{encoded}"
+    return f"{body}_{_sign_video_link(body)}"
+
+
+def parse_video_payload(payload: str) -> Optional[int]:
+    """Get the serial from a /start payload, or None if invalid, unsigned or expired."""
+    if not payload.startswith("v"):
+        return None
+    
+    parts = payload.split("_")
+    
+    try:
+        serial = int(parts[0][1:])
+        
+        if len(parts) == 1:
+            return None if DEEPLINK_SIGNED_ONLY else serial
+        
+        if len(parts) != 3 or not DEEPLINK_SECRET:
+            return None
+        
+        body = f"{parts[0]}_{parts[1]}"
+        if not hmac.compare_digest(parts[2], _sign_video_link(body)):
+            return None
+        if int(parts[1], 36) < time.time():
+            return None
+    except ValueError:
+        return None
+    
+    return serial
+
+
+async def deliver_video(context: ContextTypes.DEFAULT_TYPE, chat_id: int, serial: int) -> Optional[str]:
+    """Send a stored video to a chat with the method matching its kind.
+    
+    Returns an error message, or None on success.
+    """
+    video_data = get_video(serial)
+    
+    if not video_data:
+        return f"📭 Video #{serial} not found!"
+    
+    kind = video_kind(video_data)
+    file_id = video_data.get("file_id")
+    caption = video_data.get("caption", "")
+    
+    try:
+        if kind == "video_note":
+            # Video notes cannot carry a caption
+            await context.bot.send_video_note(chat_id=chat_id, video_note=file_id)
+        elif kind == "document":
+            await context.bot.send_document(chat_id=chat_id, document=file_id, caption=caption)
+        else:
+            await context.bot.send_video(chat_id=chat_id, video=file_id, caption=caption)
+    except Exception as e:
+        return f"❌ Error sending video: {e}"
+    
+    return None
+
+
+# =============================================================================
+# ANTI-FLOOD MIDDLEWARE
+# =============================================================================
+
+# user_id -> monotonic timestamps of accepted updates inside the current window
+_flood_hits: Dict[int, Deque[float]] = {}
+# user_id -> monotonic time until which no further cooldown reply is sent
+_flood_warned: Dict[int, float] = {}
+_flood_last_sweep = 0.0
+# Time source of the limiter; tools/replay.py swaps in the recorded arrival time
+flood_clock: Callable[[], float] = time.monotonic
+
+
+def _sweep_flood_state(now: float):
+    """Drop tracking state of users that have been quiet for a full window."""
+    global _flood_last_sweep
+    
+    if now - _flood_last_sweep < FLOOD_WINDOW:
+        return
+    _flood_last_sweep = now
+    
+    for user_id in [uid for uid, hits in _flood_hits.items() if not hits or now - hits[-1] >= FLOOD_WINDOW]:
+        del _flood_hits[user_id]
+    for user_id in [uid for uid, until in _flood_warned.items() if until <= now]:
+        del _flood_warned[user_id]
+
+
+def is_flooding(user_id: int, now: float) -> bool:
+    """Record an update in the user's sliding window, return True if over the limit."""
+    _sweep_flood_state(now)
+    
+    hits = _flood_hits.get(user_id)
+    if hits is None:
+        hits = _flood_hits[user_id] = deque()
+    
+    while hits and now - hits[0] >= FLOOD_WINDOW:
+        hits.popleft()
+    
+    if len(hits) >= FLOOD_LIMIT:
+        return True
+    
+    hits.append(now)
+    return False
+
+
+async def throttle_updates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Drop updates from users exceeding the flood limit before any handler runs."""
+    user = update.effective_user
+    
+    # Membership updates are not user requests and must never be dropped.
+    # Inline queries arrive per keystroke and are served from cache.
+    if user is None or FLOOD_LIMIT <= 0 or update.chat_member or update.inline_query:
+        return
+    
+    now = flood_clock()
+    
+    if not is_flooding(user.id, now):
+        return
+    
+    # Already told to slow down in this window - drop silently
+    if now < _flood_warned.get(user.id, 0.0):
+        raise ApplicationHandlerStop
+    
+    # Admins may legitimately burst, e.g. when forwarding a batch of videos
+    if is_admin(user.id):
+        return
+    
+    _flood_warned[user.id] = now + FLOOD_WINDOW
+    text = f"⏳ Too many requests! Please wait {int(FLOOD_WINDOW)} seconds."
+    
+    try:
+        if update.callback_query:
+            await update.callback_query.answer(text)
+        elif update.message:
+            await update.message.reply_text(text)
+    except Exception as e:
+        logger.error(f"Failed to send cooldown notice to {user.id}: {e}")
+    
+    raise ApplicationHandlerStop
+
+
+# =============================================================================
+# EVENT LOOP MONITOR
+# =============================================================================
+
+# Monotonic time of the monitor's last tick on the event loop
+_loop_heartbeat = 0.0
+# Set while the loop keeps up; background work waits on it (None = not monitored)
+_loop_healthy: Optional[asyncio.Event] = None
+_polling_paused = False
+loop_stats = {"lag": 0.0, "max_lag": 0.0, "queue": 0, "stalls": 0, "overloads": 0}
+
+
+def watch_loop_stalls(loop_thread_id: int, stop: threading.Event):
+    """Log the loop thread's stack whenever the heartbeat stops for too long.
+    
+    Runs in its own thread, so it sees the stall while it is happening and
+    the stack shows the code that is blocking the loop.
+    """
+    reported = 0.0
+    
+    while not stop.wait(LOOP_MONITOR_INTERVAL):
+        heartbeat = _loop_heartbeat
+        stalled = time.monotonic() - heartbeat
+        
+        if stalled < LOOP_STALL_THRESHOLD or heartbeat == reported:
+            continue
+        reported = heartbeat
+        
+        frame = sys._current_frames().get(loop_thread_id)
+        if frame is None:
+            continue
+        
+        loop_stats["stalls"] += 1
+        stack = "".join(traceback.format_stack(frame))
+        logger.warning(f"Event loop blocked for {stalled:.2f}s, loop thread stack:\n{stack}")
+
+
+async def set_overloaded(application: Application, overloaded: bool, queue_size: int):
+    """Enter or leave backpressure mode.
+    
+    Broadcasts and archival wait on _loop_healthy. In polling mode, getUpdates
+    also stops while the queue is over the limit so Telegram holds the backlog.
+    """
+    global _polling_paused
+    
+    if overloaded and _loop_healthy.is_set():
+        _loop_healthy.clear()
+        loop_stats["overloads"] += 1
+        logger.warning(f"Event loop overloaded (lag {loop_stats['lag']:.2f}s, {queue_size} updates queued), pausing background work")
+    elif not overloaded and not _loop_healthy.is_set():
+        _loop_healthy.set()
+        logger.info("Event loop recovered, resuming background work")
+    
+    updater = application.updater
+    if WEBHOOK_URL or updater is None:
+        return
+    
+    if queue_size > UPDATE_QUEUE_LIMIT and updater.running and not _polling_paused:
+        _polling_paused = True
+        logger.warning(f"{queue_size} updates queued, pausing polling")
+        await updater.stop()
+    elif _polling_paused and queue_size <= UPDATE_QUEUE_LIMIT // 2 and application.running:
+        _polling_paused = False
+        logger.info("Update queue drained, resuming polling")
+        await updater.start_polling(allowed_updates=Update.ALL_TYPES)
+
+
+async def monitor_event_loop(application: Application):
+    """Measure loop lag and update queue depth, and apply backpressure.
+    
+    Lag is how late the monitor's sleep wakes up. Overload starts above
+    LOOP_LAG_LIMIT or UPDATE_QUEUE_LIMIT and ends below half of both.
+    """
+    global _loop_heartbeat, _loop_healthy, _polling_paused
+    
+    _loop_heartbeat = time.monotonic()
+    _loop_healthy = asyncio.Event()
+    _loop_healthy.set()
+    
+    stop = threading.Event()
+    watchdog = threading.Thread(
+        target=watch_loop_stalls, args=(threading.get_ident(), stop),
+        name="loop-watchdog", daemon=True,
+    )
+    watchdog.start()
+    
+    try:
+        while True:
+            await asyncio.sleep(LOOP_MONITOR_INTERVAL)
+            now = time.monotonic()
+            lag = max(0.0, now - _loop_heartbeat - LOOP_MONITOR_INTERVAL)
+            _loop_heartbeat = now
+            
+            queue_size = application.update_queue.qsize()
+            loop_stats["lag"] = lag
+            loop_stats["max_lag"] = max(loop_stats["max_lag"], lag)
+            loop_stats["queue"] = queue_size
+            
+            if lag > LOOP_LAG_LIMIT or queue_size > UPDATE_QUEUE_LIMIT:
+                overloaded = True
+            elif lag <= LOOP_LAG_LIMIT / 2 and queue_size <= UPDATE_QUEUE_LIMIT // 2:
+                overloaded = False
+            else:
+                overloaded = not _loop_healthy.is_set()
+            
+            try:
+                await set_overloaded(application, overloaded, queue_size)
+            except Exception as e:
+                logger.error(f"Error applying backpressure: {e}")
+    finally:
+        stop.set()
+        _loop_healthy.set()
+        _polling_paused = False
+
+
+async def wait_for_capacity(timeout: Optional[float] = None) -> bool:
+    """Wait until the event loop is not overloaded; False if the timeout passed first."""
+    if _loop_healthy is None or _loop_healthy.is_set():
+        return True
+    
+    try:
+        await asyncio.wait_for(_loop_healthy.wait(), timeout)
+    except asyncio.TimeoutError:
+        return False
+    return True
+
+
+# =============================================================================
+# UPDATE RECORDING
+# =============================================================================
+
+# Fields holding names or other identifying text, replaced outright
+_RECORD_NAME_FIELDS = {
+    "first_name", "last_name", "username", "title", "invite_link", "phone_number", "bio",
+    "address", "vcard", "foursquare_id", "google_place_id",
+}
+# Free text, masked but kept at the same length (and command) so entities stay valid
+_RECORD_TEXT_FIELDS = {"text", "caption"}
+# Coordinates of shared locations, venues and location-aware inline queries
+_RECORD_COORDINATE_FIELDS = {"latitude", "longitude"}
+# Bare user/chat ids outside user and chat objects (join requests, shared users/chats, migrations)
+_RECORD_ID_FIELDS = {"user_id", "user_ids", "user_chat_id", "chat_id", "migrate_to_chat_id", "migrate_from_chat_id"}
+_QUERY_MASK_ALPHABET = "abcdefghijklmnopqrstuvwxyz0123456789"
+
+_record_file = None
+_record_path = ""
+
+
+def _pseudonym(value: int) -> int:
+    """Map a user/chat id to a stable pseudonymous id with the same sign."""
+    digest = hmac.new(UPDATE_RECORD_SALT.encode(), str(abs(value)).encode(), hashlib.sha256).hexdigest()
+    pseudonym = int(digest[:12], 16) % 10 ** 10 + 1
+    return -pseudonym if value < 0 else pseudonym
+
+
+def _mask_text(text: str) -> str:
+    """Replace text with a deterministic same-length token, keeping a leading /command.
+    
+    /start payloads are bot-generated deep links and are kept so replays follow them.
+    """
+    prefix = ""
+    if text.startswith("/"):
+        command, separator, text = text.partition(" ")
+        if command.split("@")[0] == "/start":
+            return command + separator + text
+        prefix = command + separator
+    if not text:
+        return prefix
+    digest = hashlib.sha256((UPDATE_RECORD_SALT + text).encode()).hexdigest()
+    return prefix + (digest * (len(text) // len(digest) + 1))[:len(text)]
+
+
+def _mask_query(query: str) -> str:
+    """Mask an inline query character by character, each derived from the prefix up to it.
+    
+    Queries sharing a prefix keep sharing the masked prefix, so replays exercise
+    the inline search cache the way the live typing did.
+    """
+    digest = hashlib.sha256(UPDATE_RECORD_SALT.encode())
+    masked = []
+    for char in query:
+        digest.update(char.encode())
+        masked.append(" " if char == " " else _QUERY_MASK_ALPHABET[digest.copy().digest()[0] % len(_QUERY_MASK_ALPHABET)])
+    return "".join(masked)
+
+
+def anonymize_update(data: Any) -> Any:
+    """Strip personal data from a serialized update, keeping its shape."""
+    if isinstance(data, list):
+        return [anonymize_update(item) for item in data]
+    if not isinstance(data, dict):
+        return data
+    
+    # User and chat objects are the dicts carrying is_bot / type next to an id
+    is_identity = "id" in data and ("is_bot" in data or "type" in data)
+    result = {}
+    
+    for key, value in data.items():
+        if key in _RECORD_NAME_FIELDS and isinstance(value, str):
+            result[key] = f"{key}_{hashlib.sha256((UPDATE_RECORD_SALT + value).encode()).hexdigest()[:8]}"
+        elif key in _RECORD_TEXT_FIELDS and isinstance(value, str):
+            result[key] = _mask_text(value)
+        elif key == "query" and isinstance(value, str):
+            result[key] = _mask_query(value)
+        elif key in _RECORD_COORDINATE_FIELDS and isinstance(value, (int, float)):
+            result[key] = 0.0
+        elif key == "id" and isinstance(value, int) and is_identity:
+            result[key] = _pseudonym(value)
+        elif key in _RECORD_ID_FIELDS and isinstance(value, int):
+            result[key] = _pseudonym(value)
+        elif key in _RECORD_ID_FIELDS and isinstance(value, list):
+            result[key] = [_pseudonym(item) if isinstance(item, int) else item for item in value]
+        elif key == "url" and data.get("type") == "text_link" and isinstance(value, str):
+            result[key] = f"https://example.com/{hashlib.sha256((UPDATE_RECORD_SALT + value).encode()).hexdigest()[:8]}"
+        else:
+            result[key] = anonymize_update(value)
+    
+    return result
+
+
+def _open_record_file():
+    """Start a new recording file."""
+    global _record_file, _record_path
+    
+    if _record_file is not None:
+        _record_file.close()
+    
+    os.makedirs(UPDATE_RECORD_DIR, exist_ok=True)
+    _record_path = os.path.join(
+        UPDATE_RECORD_DIR, f"updates-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}.jsonl"
+    )
+    _record_file = open(_record_path, "a", encoding="utf-8", buffering=1)
+    logger.info(f"Recording updates to {_record_path}")
+
+
+def close_record_file():
+    """Close the current recording file, if any."""
+    global _record_file
+    
+    if _record_file is not None:
+        _record_file.close()
+        _record_file = None
+
+
+async def record_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Append the anonymized update with its arrival time to the recording."""
+    try:
+        if _record_file is None or _record_file.tell() >= UPDATE_RECORD_MAX_BYTES:
+            _open_record_file()
+        
+        line = json.dumps({"t": time.time(), "update": anonymize_update(update.to_dict())}, ensure_ascii=False)
+        _record_file.write(line + "\n")
+    except Exception as e:
+        logger.error(f"Error recording update: {e}")
+
+
+# =============================================================================
+# VIDEO LIST RENDERING
+# =============================================================================
+
+def render_videos_page(videos: Dict, page: int) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Render one page of the video list with watch and navigation buttons."""
+    if not videos:
+        return "📭 No videos available yet!", None
+    
+    serials = sorted(int(serial) for serial in videos)
+    total_pages = (len(serials) + VIDEOS_PER_PAGE - 1) // VIDEOS_PER_PAGE
+    page = min(max(page, 1), total_pages)
+    page_serials = serials[(page - 1) * VIDEOS_PER_PAGE:page * VIDEOS_PER_PAGE]
+    
+    text = "📺 <b>Available Videos</b>"
+    if total_pages > 1:
+        text += f" (page {page}/{total_pages})"
+    text += "\n\n"
+    
+    for serial in page_serials:
+        video_data = videos.get(str(serial)) or videos.get(serial) or {}
+        caption = video_data.get("caption", "No caption")
+        text += f"• Video #{serial}: {caption}\n"
+    
+    keyboard = [
+        [
+            InlineKeyboardButton(f"▶️ #{serial}", callback_data=encode_callback("vid", serial))
+            for serial in page_serials[i:i + VIDEO_BUTTONS_PER_ROW]
+        ]
+        for i in range(0, len(page_serials), VIDEO_BUTTONS_PER_ROW)
+    ]
+    
+    if total_pages > 1:
+        navigation = []
+        if page > 1:
+            navigation.append(InlineKeyboardButton("◀️ Prev", callback_data=encode_callback("pg", page - 1)))
+        if page < total_pages:
+            navigation.append(InlineKeyboardButton("Next ▶️", callback_data=encode_callback("pg", page + 1)))
+        keyboard.append(navigation)
+    
+    keyboard.append([InlineKeyboardButton("🎬 Watch Latest", callback_data="watch_latest")])
+    
+    return text, InlineKeyboardMarkup(keyboard)
+
+
 # =============================================================================
 # COMMAND HANDLERS
 # =============================================================================
@@ -288,14 +2032,33 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     # Save user to database
-    save_user(
+    await save_user(
         user_id=user.id,
         username=user.username or "",
         first_name=user.first_name or ""
     )
     
+    # Deep link to a specific video, e.g. t.me/<bot>?start=v12
+    payload = context.args[0] if context.args else ""
+    serial = parse_video_payload(payload)
+    
+    # Only carry links to existing videos through the force join "check again" button
+    if serial is not None and not get_video(serial):
+        await update.message.reply_text(f"📭 Video #{serial} not found!")
+        return
+    
     # Check force join
-    if not await check_force_join(update, user.id, context):
+    if not await check_force_join(update, user.id, context, payload if serial is not None else ""):
+        return
+    
+    if serial is not None:
+        error = await deliver_video(context, user.id, serial)
+        if error:
+            await update.message.reply_text(error)
+        return
+    
+    if payload.startswith("v"):
+        await update.message.reply_text("⚠️ This video link is invalid or has expired.")
         return
     
     # Welcome message
@@ -336,6 +2099,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         text += "/setchannel - Set private channel ID\n"
         text += "/autosync - Enable auto sync\n"
         text += "/syncnow - Sync videos now\n"
+        text += "/videolink - Create a link to a video\n"
+        text += "/profile - Profile handlers for N seconds\n"
         text += "/adminkey - Add new admin (owner only)"
     
     await update.message.reply_text(text, parse_mode="HTML")
@@ -357,11 +2122,18 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     text = "🔧 <b>Admin Panel</b>\n\n"
     text += f"📊 <b>Statistics:</b>\n"
-    text += f"• Total Users: {len(users)}\n"
+    text += f"• Total Users: {len(users) + count_cold_users()}\n"
+    text += f"• Active Users: {len(users)}\n"
     text += f"• Total Codes: {len(codes)}\n"
     text += f"• Force Channels: {len(channels)}\n"
     text += f"• Total Videos: {len(videos)}\n\n"
     
+    if _loop_healthy is not None:
+        text += "⏱ <b>Load:</b>\n"
+        text += f"• Loop Lag: {loop_stats['lag'] * 1000:.0f} ms (max {loop_stats['max_lag'] * 1000:.0f} ms)\n"
+        text += f"• Queued Updates: {loop_stats['queue']}\n"
+        text += f"• Stalls / Overloads: {loop_stats['stalls']} / {loop_stats['overloads']}\n\n"
+    
     text += "<b>Quick Actions:</b>\n"
     
     keyboard = [
@@ -391,7 +2163,7 @@ async def addcode_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     code = " ".join(context.args)
     
-    if add_code(code):
+    if await add_code(code):
         await update.message.reply_text(f"✅ Code <code>{code}</code> added successfully!", parse_mode="HTML")
     else:
         await update.message.reply_text(f"⚠️ Code <code>{code}</code> already exists!", parse_mode="HTML")
@@ -411,7 +2183,7 @@ async def addforce_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     channel = context.args[0]
     
-    if add_force_channel(channel):
+    if await add_force_channel(channel):
         await update.message.reply_text(f"✅ Channel {channel} added to force join!", parse_mode="HTML")
         
         # Verify bot is admin
@@ -445,44 +2217,95 @@ async def removeforce_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     channel = context.args[0]
     
-    if remove_force_channel(channel):
+    if await remove_force_channel(channel):
         await update.message.reply_text(f"✅ Channel {channel} removed from force join!", parse_mode="HTML")
     else:
         await update.message.reply_text(f"⚠️ Channel {channel} not found!", parse_mode="HTML")
 
 
 async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /broadcast command."""
+    """Handle /broadcast command.
+    
+    Sends text, or copies the replied-to message (any media or formatting)
+    by reusing its file_id, to every user matching the segment filters.
+    """
     user_id = update.effective_user.id
     
     if not is_admin(user_id):
         await update.message.reply_text("❌ You are not authorized to use this command.")
         return
     
-    if not context.args:
-        await update.message.reply_text("⚠️ Usage: /broadcast <MESSAGE>\n\nExample: /broadcast Hello everyone!")
-        return
+    source = update.message.reply_to_message
     
-    message = " ".join(context.args)
-    users = get_users()
+    try:
+        segment, words = parse_broadcast_args(context.args or [])
+    except ValueError as e:
+        await update.message.reply_text(f"⚠️ {e}")
+        return
     
-    sent_count = 0
-    failed_count = 0
+    if not words and not source:
+        await update.message.reply_text(
+            "⚠️ Usage: /broadcast [FILTERS] <MESSAGE>\n"
+            "or reply to any message with /broadcast [FILTERS] to copy it.\n\n"
+            "Filters: active=<DAYS> since=<YYYY-MM-DD> verified=<yes|no> ids=<FROM>-<TO>\n\n"
+            "Example: /broadcast active=7 verified=yes Hello everyone!"
+        )
+        return
     
-    await update.message.reply_text(f"📢 Broadcasting to {len(users)} users...")
+    message = " ".join(words)
     
-    for user in users:
-        try:
-            await context.bot.send_message(
-                chat_id=user["id"],
-                text=message
-            )
-            sent_count += 1
-        except Exception as e:
-            logger.error(f"Failed to send to {user['id']}: {e}")
-            failed_count += 1
+    # Only one worker may run a broadcast at a time
+    lock = state_lock("broadcast", ttl=BROADCAST_LOCK_TTL)
+    if not lock.acquire():
+        await update.message.reply_text("⚠️ Another broadcast is already running!")
+        return
     
-    text = f"✅ <b>Broadcast Complete</b>\n\n"
+    try:
+        sent_count = 0
+        failed_count = 0
+        interrupted = False
+        
+        await update.message.reply_text(f"📢 Broadcasting to {describe_segment(segment)}...")
+        
+        # Segments filter on last_seen and verified, which may still be batched in memory
+        await flush_user_updates()
+        
+        for batch in iter_segment_batches(segment):
+            # Shutdown waits for this handler, so give up once the grace period is over
+            if stop_grace_expired(context.application):
+                interrupted = True
+                break
+            
+            for target_id in batch:
+                try:
+                    if source:
+                        await context.bot.copy_message(
+                            chat_id=target_id,
+                            from_chat_id=source.chat_id,
+                            message_id=source.message_id
+                        )
+                    else:
+                        await context.bot.send_message(
+                            chat_id=target_id,
+                            text=message
+                        )
+                    sent_count += 1
+                except Exception as e:
+                    logger.error(f"Failed to send to {target_id}: {e}")
+                    failed_count += 1
+            
+            lock.extend()
+            
+            # Give interactive updates priority while the bot is overloaded
+            while context.application.running and not await wait_for_capacity(1):
+                lock.extend()
+    finally:
+        lock.release()
+    
+    if interrupted:
+        text = "⚠️ <b>Broadcast Interrupted</b> by a bot restart, the remaining users were skipped.\n\n"
+    else:
+        text = f"✅ <b>Broadcast Complete</b>\n\n"
     text += f"• Sent: {sent_count}\n"
     text += f"• Failed: {failed_count}"
     
@@ -511,7 +2334,7 @@ async def adminkey_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         new_admin_id = int(new_admin_id)
-        if add_admin(new_admin_id):
+        if await add_admin(new_admin_id):
             await update.message.reply_text(f"✅ User {new_admin_id} added as admin!")
         else:
             await update.message.reply_text(f"⚠️ User {new_admin_id} is already an admin!")
@@ -527,23 +2350,12 @@ async def videos_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_force_join(update, user_id, context):
         return
     
-    videos = get_videos()
+    text, reply_markup = render_videos_page(get_videos(), 1)
     
-    if not videos:
-        await update.message.reply_text("📭 No videos available yet!")
+    if reply_markup is None:
+        await update.message.reply_text(text)
         return
     
-    text = "📺 <b>Available Videos</b>\n\n"
-    
-    for serial, video_data in sorted(videos.items()):
-        caption = video_data.get("caption", "No caption")
-        text += f"• Video #{serial}: {caption}\n"
-    
-    keyboard = [
-        [InlineKeyboardButton("🎬 Watch Latest", callback_data="watch_latest")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="HTML")
 
 
@@ -672,14 +2484,97 @@ async def syncnow_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Error syncing: {e}")
         await update.message.reply_text(
-            f"❌ <b>Sync Error</b>\n\n"
-            f"Error: {e}\n\n"
-            f"<b>Troubleshooting:</b>\n"
-            f"• Make sure bot is admin in the channel\n"
-            f"• Check if channel ID is correct\n"
-            f"• Bot must be member of the channel",
-            parse_mode="HTML"
+            f"❌ <b>Sync Error</b>\n\n"
+            f"Error: {e}\n\n"
+            f"<b>Troubleshooting:</b>\n"
+            f"• Make sure bot is admin in the channel\n"
+            f"• Check if channel ID is correct\n"
+            f"• Bot must be member of the channel",
+            parse_mode="HTML"
+        )
+
+
+async def videolink_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /videolink command - Create a deep link to a video."""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ You are not authorized to use this command.")
+        return
+    
+    if not context.args:
+        await update.message.reply_text(
+            "⚠️ Usage: /videolink <SERIAL> [HOURS]\n\n"
+            "Example: /videolink 12 24 (link expires after 24 hours)"
+        )
+        return
+    
+    try:
+        serial = int(context.args[0].lstrip("#"))
+        hours = float(context.args[1]) if len(context.args) > 1 else None
+    except ValueError:
+        await update.message.reply_text("⚠️ Invalid serial or hours!")
+        return
+    
+    if not get_video(serial):
+        await update.message.reply_text(f"📭 Video #{serial} not found!")
+        return
+    
+    payload = make_video_payload(serial, int(hours * 3600) if hours else None)
+    if payload is None:
+        await update.message.reply_text("⚠️ Set DEEPLINK_SECRET to create signed or expiring links.")
+        return
+    
+    link = f"https://t.me/{context.bot.username}?start={payload}"
+    
+    text = f"🔗 <b>Link for Video #{serial}</b>\n\n<code>{link}</code>"
+    if hours:
+        text += f"\n\nExpires in {hours:g} hours."
+    
+    await update.message.reply_text(text, parse_mode="HTML")
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /profile command - Profile live handlers for a while."""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ You are not authorized to use this command.")
+        return
+    
+    if _profiling_active:
+        await update.message.reply_text("⚠️ Profiling is already running!")
+        return
+    
+    try:
+        seconds = int(context.args[0]) if context.args else 60
+        sample_rate = float(context.args[1]) if len(context.args) > 1 else 1.0
+    except ValueError:
+        seconds = 0
+        sample_rate = 0.0
+    
+    if not 0 < seconds <= PROFILE_MAX_SECONDS or not 0 < sample_rate <= 1:
+        await update.message.reply_text(
+            f"⚠️ Usage: /profile <SECONDS> [SAMPLE_RATE]\n\n"
+            f"Example: /profile 60 0.5 (up to {PROFILE_MAX_SECONDS} seconds, rate 0-1)"
+        )
+        return
+    
+    start_profiling(sample_rate)
+    await update.message.reply_text(f"⏱ Profiling handlers for {seconds} seconds...")
+    
+    async def send_report():
+        await asyncio.sleep(seconds)
+        report = stop_profiling()
+        document = io.BytesIO(report.encode("utf-8"))
+        document.name = f"profile-{datetime.now():%Y%m%d-%H%M%S}.txt"
+        await context.bot.send_document(
+            chat_id=update.effective_chat.id,
+            document=document,
+            caption=f"⏱ Handler profile ({seconds}s)",
         )
+    
+    start_background_task(send_report())
 
 
 async def mycode_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -697,108 +2592,297 @@ async def mycode_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+# =============================================================================
+# INLINE QUERY HANDLERS
+# =============================================================================
+
+# (catalogue version, query) -> matching serials, newest first
+_inline_results: "OrderedDict[Tuple[str, str], List[int]]" = OrderedDict()
+
+
+def search_videos(query: str) -> List[int]:
+    """Find serials whose "#serial caption" contains the query, newest first.
+    
+    Results are kept in an LRU per catalogue version. A query extending a
+    cached one (e.g. "cat" after "ca") only filters the cached matches, since
+    every match of the longer query also matches its prefix.
+    """
+    catalog = get_video_catalog()
+    query = query.strip().lower()
+    key = (_video_catalog_version, query)
+    
+    if key in _inline_results:
+        _inline_results.move_to_end(key)
+        return _inline_results[key]
+    
+    # Longest cached prefix, falling back to the whole catalogue
+    candidates = None
+    for length in range(len(query) - 1, -1, -1):
+        candidates = _inline_results.get((_video_catalog_version, query[:length]))
+        if candidates is not None:
+            break
+    if candidates is None:
+        candidates = sorted(catalog, reverse=True)
+    
+    matches = [
+        serial for serial in candidates
+        if video_kind(catalog[serial]) in INLINE_KINDS
+        and query in f"#{serial} {catalog[serial].get('caption', '')}".lower()
+    ]
+    
+    _inline_results[key] = matches
+    if len(_inline_results) > INLINE_LRU_SIZE:
+        _inline_results.popitem(last=False)
+    
+    return matches
+
+
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answer @bot inline queries from the video catalogue."""
+    inline_query = update.inline_query
+    
+    # Force join applies here too; answers are then cached per user only.
+    # Inline queries skip the flood limiter, so failed checks are cached briefly.
+    is_personal = bool(get_cache().smembers(ensure_index("force")))
+    if is_personal and await get_unjoined_channels(inline_query.from_user.id, context, INLINE_NOT_JOINED_TTL):
+        # Not cached by Telegram, so results appear as soon as the user joined
+        await inline_query.answer(
+            [],
+            cache_time=0,
+            is_personal=True,
+            button=InlineQueryResultsButton(text="🔒 Join required channels first", start_parameter="join"),
+        )
+        return
+    
+    try:
+        offset = int(inline_query.offset or 0)
+    except ValueError:
+        offset = 0
+    
+    serials = search_videos(inline_query.query)
+    catalog = get_video_catalog()
+    
+    results = []
+    for serial in serials[offset:offset + INLINE_PAGE_SIZE]:
+        video = catalog[serial]
+        caption = video.get("caption", "")
+        
+        # One result of the wrong type makes Telegram reject the whole answer
+        if video_kind(video) == "document":
+            results.append(InlineQueryResultCachedDocument(
+                id=str(serial),
+                document_file_id=video["file_id"],
+                title=f"Video #{serial}",
+                description=caption,
+                caption=caption,
+            ))
+        else:
+            results.append(InlineQueryResultCachedVideo(
+                id=str(serial),
+                video_file_id=video["file_id"],
+                title=f"Video #{serial}",
+                description=caption,
+                caption=caption,
+            ))
+    next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(serials) else ""
+    
+    await inline_query.answer(
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=is_personal,
+        next_offset=next_offset,
+    )
+
+
 # =============================================================================
 # CALLBACK QUERY HANDLERS
 # =============================================================================
 
+# Routes are keyed by the prefix before the first separator, so dispatch is a
+# single dict lookup no matter how many routes exist. Payload fields follow the
+# prefix, e.g. "vid:123" or "pg:4". Telegram limits callback data to 64 bytes.
+CALLBACK_SEPARATOR = ":"
+CALLBACK_DATA_LIMIT = 64
+
+CallbackRoute = Callable[[Update, ContextTypes.DEFAULT_TYPE, List[str]], Awaitable[None]]
+CALLBACK_ROUTES: Dict[str, CallbackRoute] = {}
+
+
+def callback_route(prefix: str):
+    """Register a callback query handler for a callback data prefix."""
+    def decorator(func: CallbackRoute) -> CallbackRoute:
+        if prefix in CALLBACK_ROUTES:
+            raise ValueError(f"Duplicate callback route: {prefix}")
+        CALLBACK_ROUTES[prefix] = func
+        return func
+    return decorator
+
+
+def encode_callback(prefix: str, *args: Any) -> str:
+    """Encode a route prefix and its payload into callback data."""
+    data = CALLBACK_SEPARATOR.join([prefix, *(str(arg) for arg in args)])
+    if len(data.encode("utf-8")) > CALLBACK_DATA_LIMIT:
+        raise ValueError(f"Callback data too long: {data}")
+    return data
+
+
+def decode_callback(data: str) -> Tuple[str, List[str]]:
+    """Split callback data into its route prefix and payload fields."""
+    prefix, _, payload = data.partition(CALLBACK_SEPARATOR)
+    return prefix, payload.split(CALLBACK_SEPARATOR) if payload else []
+
+
 async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle callback queries."""
+    """Dispatch callback queries to their registered route."""
     query = update.callback_query
     await query.answer()
     
+    prefix, args = decode_callback(query.data or "")
+    route = CALLBACK_ROUTES.get(prefix)
+    
+    if route is None:
+        logger.warning(f"Unknown callback data: {query.data}")
+        return
+    
+    await route(update, context, args)
+
+
+@callback_route("check_join")
+async def check_join_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+    """Re-check force join - check_join[:<deep link payload>]."""
+    payload = args[0] if args else ""
     user_id = update.effective_user.id
-    data = query.data
-    
-    if data == "check_join":
-        # Re-check force join
-        if await check_force_join(update, user_id, context):
-            await query.edit_message_text("✅ <b>Access Granted!</b>\n\nWelcome to the bot! Use /help to see available commands.", parse_mode="HTML")
-    
-    elif data == "admin_addcode":
-        await query.edit_message_text(
-            "📝 <b>Add Access Code</b>\n\n"
-            "Usage: /addcode <CODE>\n\n"
-            "Example: /addcode MYCODE123",
-            parse_mode="HTML"
-        )
     
-    elif data == "admin_addforce":
-        await query.edit_message_text(
-            "➕ <b>Add Force Join Channel</b>\n\n"
-            "Usage: /addforce @channel\n\n"
-            "Example: /addforce @mychannel\n\n"
-            "Note: Bot must be admin in the channel.",
-            parse_mode="HTML"
-        )
+    if not await check_force_join(update, user_id, context, payload):
+        return
     
-    elif data == "admin_broadcast":
-        await query.edit_message_text(
-            "📢 <b>Broadcast Message</b>\n\n"
-            "Usage: /broadcast <MESSAGE>\n\n"
-            "Example: /broadcast Hello everyone!",
-            parse_mode="HTML"
-        )
+    await update.callback_query.edit_message_text("✅ <b>Access Granted!</b>\n\nWelcome to the bot! Use /help to see available commands.", parse_mode="HTML")
     
-    elif data == "admin_videosync":
-        await query.edit_message_text(
-            "🔄 <b>Video Sync</b>\n\n"
-            "Forward a video from your private channel to sync it.\n\n"
-            "Usage: /videosync",
-            parse_mode="HTML"
-        )
+    # Deliver the video the user originally opened the bot for
+    serial = parse_video_payload(payload)
+    if serial is not None:
+        error = await deliver_video(context, user_id, serial)
+        if error:
+            await context.bot.send_message(chat_id=user_id, text=error)
+
+
+@callback_route("admin_addcode")
+async def admin_addcode_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+    """Show add code usage."""
+    await update.callback_query.edit_message_text(
+        "📝 <b>Add Access Code</b>\n\n"
+        "Usage: /addcode <CODE>\n\n"
+        "Example: /addcode MYCODE123",
+        parse_mode="HTML"
+    )
+
+
+@callback_route("admin_addforce")
+async def admin_addforce_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+    """Show add force channel usage."""
+    await update.callback_query.edit_message_text(
+        "➕ <b>Add Force Join Channel</b>\n\n"
+        "Usage: /addforce @channel\n\n"
+        "Example: /addforce @mychannel\n\n"
+        "Note: Bot must be admin in the channel.",
+        parse_mode="HTML"
+    )
+
+
+@callback_route("admin_broadcast")
+async def admin_broadcast_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+    """Show broadcast usage."""
+    await update.callback_query.edit_message_text(
+        "📢 <b>Broadcast Message</b>\n\n"
+        "Usage: /broadcast <MESSAGE>\n\n"
+        "Example: /broadcast Hello everyone!",
+        parse_mode="HTML"
+    )
+
+
+@callback_route("admin_videosync")
+async def admin_videosync_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+    """Show video sync usage."""
+    await update.callback_query.edit_message_text(
+        "🔄 <b>Video Sync</b>\n\n"
+        "Forward a video from your private channel to sync it.\n\n"
+        "Usage: /videosync",
+        parse_mode="HTML"
+    )
+
+
+@callback_route("admin_channels")
+async def admin_channels_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+    """List force join channels."""
+    channels = get_force_channels()
     
-    elif data == "admin_channels":
-        channels = get_force_channels()
-        
-        if not channels:
-            text = "📋 <b>Force Join Channels</b>\n\nNo channels added yet."
-        else:
-            text = "📋 <b>Force Join Channels</b>\n\n"
-            for i, ch in enumerate(channels, 1):
-                text += f"{i}. {ch.get('channel', '')}\n"
-        
-        await query.edit_message_text(text, parse_mode="HTML")
+    if not channels:
+        text = "📋 <b>Force Join Channels</b>\n\nNo channels added yet."
+    else:
+        text = "📋 <b>Force Join Channels</b>\n\n"
+        for i, ch in enumerate(channels, 1):
+            text += f"{i}. {ch.get('channel', '')}\n"
     
-    elif data == "videos_list":
-        videos = get_videos()
-        
-        if not videos:
-            await query.edit_message_text("📭 No videos available yet!")
-            return
-        
-        text = "📺 <b>Available Videos</b>\n\n"
-        
-        for serial, video_data in sorted(videos.items()):
-            caption = video_data.get("caption", "No caption")
-            text += f"• Video #{serial}: {caption}\n"
-        
-        keyboard = [
-            [InlineKeyboardButton("🎬 Watch Latest", callback_data="watch_latest")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="HTML")
+    await update.callback_query.edit_message_text(text, parse_mode="HTML")
+
+
+@callback_route("videos_list")
+async def videos_list_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+    """Show the first page of the video list."""
+    await show_videos_page(update, 1)
+
+
+@callback_route("pg")
+async def videos_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+    """Show a page of the video list - pg:<page>."""
+    try:
+        page = int(args[0])
+    except (IndexError, ValueError):
+        page = 1
+    await show_videos_page(update, page)
+
+
+async def show_videos_page(update: Update, page: int):
+    """Edit the callback message to show a page of the video list."""
+    query = update.callback_query
+    text, reply_markup = render_videos_page(get_videos(), page)
     
-    elif data == "watch_latest":
-        videos = get_videos()
-        
-        if not videos:
-            await query.edit_message_text("📭 No videos available!")
-            return
-        
-        latest_serial = max(videos.keys())
-        video_data = videos[latest_serial]
-        file_id = video_data.get("file_id")
-        caption = video_data.get("caption", "")
-        
-        try:
-            await context.bot.send_video(
-                chat_id=user_id,
-                video=file_id,
-                caption=caption
-            )
-        except Exception as e:
-            await query.edit_message_text(f"❌ Error sending video: {e}")
+    if reply_markup is None:
+        await query.edit_message_text(text)
+        return
+    
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="HTML")
+
+
+@callback_route("watch_latest")
+async def watch_latest_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+    """Send the most recently added video."""
+    videos = get_videos()
+    
+    if not videos:
+        await update.callback_query.edit_message_text("📭 No videos available!")
+        return
+    
+    await send_video_serial(update, context, max(int(serial) for serial in videos))
+
+
+@callback_route("vid")
+async def watch_video_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, args: List[str]):
+    """Send a specific video - vid:<serial>."""
+    try:
+        serial = int(args[0])
+    except (IndexError, ValueError):
+        return
+    
+    await send_video_serial(update, context, serial)
+
+
+async def send_video_serial(update: Update, context: ContextTypes.DEFAULT_TYPE, serial: int):
+    """Send the video stored under a serial number to the user."""
+    error = await deliver_video(context, update.effective_user.id, serial)
+    
+    if error:
+        await update.callback_query.edit_message_text(error)
 
 
 # =============================================================================
@@ -815,7 +2899,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Save user
-    save_user(
+    await save_user(
         user_id=user.id,
         username=user.username or "",
         first_name=user.first_name or ""
@@ -827,6 +2911,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Check for access code
     if check_code(text):
+        mark_user_verified(user.id)
         await update.message.reply_text(
             "✅ <b>Access Granted!</b>\n\n"
             "Your code is valid. You now have access to the bot!",
@@ -854,12 +2939,10 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
     file_id = video.file_id
     caption = update.message.caption or ""
     
-    # Get next serial number
-    videos = get_videos()
-    next_serial = max(videos.keys(), default=0) + 1
+    # Save video under the next serial number
+    next_serial = await add_video(file_id, caption)
     
-    # Save video
-    if save_video(next_serial, file_id, caption):
+    if next_serial is not None:
         await update.message.reply_text(
             f"✅ <b>Video Saved!</b>\n\n"
             f"Serial Number: #{next_serial}\n"
@@ -883,12 +2966,10 @@ async def handle_video_note(update: Update, context: ContextTypes.DEFAULT_TYPE):
     video_note = update.message.video_note
     file_id = video_note.file_id
     
-    # Get next serial number
-    videos = get_videos()
-    next_serial = max(videos.keys(), default=0) + 1
+    # Save video note under the next serial number
+    next_serial = await add_video(file_id, "Video Note", kind="video_note")
     
-    # Save video note
-    if save_video(next_serial, file_id, "Video Note"):
+    if next_serial is not None:
         await update.message.reply_text(
             f"✅ <b>Video Note Saved!</b>\n\n"
             f"Serial Number: #{next_serial}",
@@ -915,12 +2996,10 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         file_id = document.file_id
         caption = update.message.caption or ""
         
-        # Get next serial number
-        videos = get_videos()
-        next_serial = max(videos.keys(), default=0) + 1
+        # Save video under the next serial number; document file_ids can only be resent as documents
+        next_serial = await add_video(file_id, caption, kind="document")
         
-        # Save video
-        if save_video(next_serial, file_id, caption):
+        if next_serial is not None:
             await update.message.reply_text(
                 f"✅ <b>Video Saved!</b>\n\n"
                 f"Serial Number: #{next_serial}\n"
@@ -946,29 +3025,184 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 # =============================================================================
-# MAIN FUNCTION
+# APPLICATION LIFECYCLE
 # =============================================================================
 
-def main():
-    """Main function to run the bot."""
-    # Validate environment variables
-    if not TOKEN:
-        logger.error("TOKEN environment variable is not set!")
-        print("ERROR: Please set the TOKEN environment variable!")
-        return
+_background_tasks: List[asyncio.Task] = []
+
+
+def start_background_task(coro: Awaitable) -> asyncio.Task:
+    """Run a coroutine in the background until it finishes or the bot shuts down."""
+    task = asyncio.create_task(coro)
+    _background_tasks.append(task)
+    task.add_done_callback(lambda done: done in _background_tasks and _background_tasks.remove(done))
+    return task
+
+
+async def last_seen_flusher():
+    """Periodically persist batched last_seen updates."""
+    while True:
+        await asyncio.sleep(LAST_SEEN_FLUSH_INTERVAL)
+        try:
+            await flush_user_updates()
+        except Exception as e:
+            logger.error(f"Error flushing user updates: {e}")
+
+
+async def user_archiver():
+    """Periodically move inactive users to the cold archive."""
+    while True:
+        await wait_for_capacity()
+        try:
+            await archive_inactive_users()
+        except Exception as e:
+            logger.error(f"Error archiving users: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+
+# Monotonic time the application was first seen stopping
+_stopping_since: Optional[float] = None
+
+
+def stop_grace_expired(application: Application) -> bool:
+    """True once the application has been stopping for longer than SHUTDOWN_DRAIN_TIMEOUT.
     
-    if not ADMIN_ID:
-        logger.warning("ADMIN_ID environment variable is not set!")
-        print("WARNING: Please set the ADMIN_ID environment variable!")
+    Application.stop() waits for every non-blocking handler before post_stop
+    runs, so long-running handlers check this to end early.
+    """
+    global _stopping_since
     
-    logger.info("Starting Telegram Video Bot...")
+    if application.running:
+        return False
+    
+    if _stopping_since is None:
+        _stopping_since = time.monotonic()
+    
+    return time.monotonic() - _stopping_since >= SHUTDOWN_DRAIN_TIMEOUT
+
+
+def save_checkpoint() -> bool:
+    """Write in-process caches to disk so the next start is warm.
+    
+    Only the in-process cache needs this; Redis keeps its own state. Set
+    indexes are skipped as they are rebuilt from the JSON documents.
+    """
+    cache = get_cache()
+    
+    if not isinstance(cache, MemoryCache):
+        return False
+    
+    checkpoint = {
+        "saved_at": time.time(),
+        "cache": cache.export(skip_prefix=cache_key("idx", "")),
+        "inline_results": list(_inline_results.items()),
+        "loop_stats": {key: loop_stats[key] for key in ("max_lag", "stalls", "overloads")},
+    }
+    
+    try:
+        write_snapshot(CHECKPOINT_FILE, checkpoint)
+    except Exception as e:
+        logger.error(f"Error writing checkpoint: {e}")
+        return False
+    
+    logger.info(f"Checkpointed {len(checkpoint['cache'])} cache entries")
+    return True
+
+
+def restore_checkpoint() -> bool:
+    """Load the checkpoint written on the last shutdown, if recent enough.
+    
+    The checkpoint is removed once read so a later crash cannot restore it twice.
+    """
+    cache = get_cache()
+    
+    if not isinstance(cache, MemoryCache):
+        return False
+    
+    try:
+        checkpoint = read_snapshot(CHECKPOINT_FILE)
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        logger.error(f"Error reading checkpoint: {e}")
+        return False
+    finally:
+        if os.path.exists(snapshot_path(CHECKPOINT_FILE)):
+            os.remove(snapshot_path(CHECKPOINT_FILE))
+    
+    if time.time() - checkpoint.get("saved_at", 0) > CHECKPOINT_MAX_AGE:
+        logger.info("Ignoring outdated checkpoint")
+        return False
+    
+    cache.restore(checkpoint.get("cache", {}))
+    _inline_results.update((tuple(key), value) for key, value in checkpoint.get("inline_results", []))
+    loop_stats.update(checkpoint.get("loop_stats", {}))
+    
+    logger.info(f"Restored {len(checkpoint.get('cache', {}))} cache entries from checkpoint")
+    return True
+
+
+async def on_startup(application: Application):
+    """Restore caches and start background tasks once the application is initialized."""
+    restore_checkpoint()
+    
+    start_background_task(last_seen_flusher())
+    if LOOP_MONITOR_INTERVAL > 0:
+        start_background_task(monitor_event_loop(application))
+    if tiering_enabled():
+        start_background_task(user_archiver())
+
+
+async def on_stop(application: Application):
+    """Stop background tasks, flush pending writes and checkpoint caches.
+    
+    Runs once queued updates and non-blocking handlers have finished, before
+    the bot's connections are closed.
+    """
+    for task in list(_background_tasks):
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
     
-    # Create application
-    application = Application.builder().token(TOKEN).build()
+    await flush_user_updates()
+    save_checkpoint()
+
+
+async def on_shutdown(application: Application):
+    """Persist anything written after on_stop and close open files."""
+    await flush_user_updates()
+    close_record_file()
+
+
+# =============================================================================
+# MAIN FUNCTION
+# =============================================================================
+
+def build_application(token: str, request: Optional[Any] = None) -> Application:
+    """Create the application with all handlers registered.
+    
+    request replaces the Bot API transport, e.g. with a fake one for replays.
+    """
+    application = (
+        Application.builder()
+        .token(token)
+        .request(request or ProfiledRequest(connection_pool_size=256))
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     
     # Add error handler
     application.add_error_handler(error_handler)
     
+    # Record raw traffic when enabled, before anything can drop it
+    if UPDATE_RECORD_DIR:
+        application.add_handler(TypeHandler(Update, record_update), group=-2)
+    
+    # Drop flooding users before any storage or network work (group -1 runs first)
+    application.add_handler(TypeHandler(Update, throttle_updates), group=-1)
+    
     # Add command handlers
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
@@ -976,13 +3210,22 @@ def main():
     application.add_handler(CommandHandler("addcode", addcode_command))
     application.add_handler(CommandHandler("addforce", addforce_command))
     application.add_handler(CommandHandler("removeforce", removeforce_command))
-    application.add_handler(CommandHandler("broadcast", broadcast_command))
+    # Broadcasts run beside other updates instead of holding up the queue
+    application.add_handler(CommandHandler("broadcast", broadcast_command, block=False))
     application.add_handler(CommandHandler("adminkey", adminkey_command))
     application.add_handler(CommandHandler("videos", videos_command))
     application.add_handler(CommandHandler("setchannel", setchannel_command))
     application.add_handler(CommandHandler("autosync", autosync_command))
     application.add_handler(CommandHandler("syncnow", syncnow_command))
     application.add_handler(CommandHandler("mycode", mycode_command))
+    application.add_handler(CommandHandler("videolink", videolink_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    
+    # Track force channel joins/leaves (bot must be admin there)
+    application.add_handler(ChatMemberHandler(track_channel_membership, ChatMemberHandler.CHAT_MEMBER))
+    
+    # Add inline query handler (enable inline mode in @BotFather)
+    application.add_handler(InlineQueryHandler(inline_query_handler))
     
     # Add callback query handler
     application.add_handler(CallbackQueryHandler(callback_handler))
@@ -993,11 +3236,47 @@ def main():
     application.add_handler(MessageHandler(filters.VIDEO_NOTE, handle_video_note))
     application.add_handler(MessageHandler(filters.Document.VIDEO, handle_document))
     
+    # Make every handler visible to /profile
+    instrument_handlers(application)
+    
+    return application
+
+
+def main():
+    """Main function to run the bot."""
+    # Validate environment variables
+    if not TOKEN:
+        logger.error("TOKEN environment variable is not set!")
+        print("ERROR: Please set the TOKEN environment variable!")
+        return
+    
+    if not ADMIN_ID:
+        logger.warning("ADMIN_ID environment variable is not set!")
+        print("WARNING: Please set the ADMIN_ID environment variable!")
+    
+    if not DEEPLINK_SECRET:
+        logger.warning("DEEPLINK_SECRET is not set - signed and expiring video links are disabled")
+    
+    logger.info("Starting Telegram Video Bot...")
+    
+    application = build_application(TOKEN)
+    
     # Start polling
     logger.info("Bot is running...")
     print("🤖 Bot is running... Press Ctrl+C to stop.")
     
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if WEBHOOK_URL:
+        # Several workers can serve the same webhook URL behind a load balancer
+        application.run_webhook(
+            listen="0.0.0.0",
+            port=PORT,
+            url_path="webhook",
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/webhook",
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
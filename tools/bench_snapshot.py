@@ -0,0 +1,131 @@
+"""
+Startup benchmark: JSON vs binary snapshot loading.
+
+Generates a synthetic users.json / videos.json, then loads them in fresh
+child processes with and without SNAPSHOT_ENABLED and reports load time and
+peak resident memory.
+
+Usage:
+    python tools/bench_snapshot.py --users 200000 --videos 5000
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def generate_data(data_dir: str, users: int, videos: int):
+    """Write synthetic data files in the bot's JSON layout."""
+    os.makedirs(data_dir, exist_ok=True)
+
+    user_list = [
+        {
+            "id": 100000000 + i,
+            "username": f"user{i}",
+            "first_name": f"Name {i}",
+            "joined": "2026-01-01T10:00:00.123456",
+            "last_seen": "2026-05-01T10:00:00.123456",
+        }
+        for i in range(users)
+    ]
+    video_map = {
+        str(serial): {
+            "file_id": f"BAACAgUAAxkBAAI{serial:012d}AAFmZ2h0eHl6",
+            "caption": f"Video number {serial}",
+            "added": "2026-01-01T10:00:00.123456",
+        }
+        for serial in range(1, videos + 1)
+    }
+
+    with open(os.path.join(data_dir, "users.json"), "w", encoding="utf-8") as f:
+        json.dump(user_list, f, indent=4, ensure_ascii=False)
+    with open(os.path.join(data_dir, "videos.json"), "w", encoding="utf-8") as f:
+        json.dump(video_map, f, indent=4, ensure_ascii=False)
+
+
+def run_child(workdir: str):
+    """Load users and videos once and print timing and memory as JSON."""
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(workdir)
+
+    import bot
+
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    users = bot.get_users()
+    videos = bot.get_videos()
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(json.dumps({
+        "seconds": elapsed,
+        "rss_kb": peak_rss - baseline_rss,
+        "users": len(users),
+        "videos": len(videos),
+    }))
+
+
+def measure(workdir: str, snapshot: bool, repeat: int) -> dict:
+    """Run the child loader several times and keep the fastest run."""
+    env = dict(os.environ, SNAPSHOT_ENABLED="1" if snapshot else "0")
+    runs = []
+
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", workdir],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    return min(runs, key=lambda run: run["seconds"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--videos", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="bench_snapshot_")
+    try:
+        data_dir = os.path.join(workdir, "data")
+        generate_data(data_dir, args.users, args.videos)
+
+        json_result = measure(workdir, snapshot=False, repeat=args.repeat)
+        # First snapshot-enabled load converts the JSON files
+        measure(workdir, snapshot=True, repeat=1)
+        snapshot_result = measure(workdir, snapshot=True, repeat=args.repeat)
+
+        sizes = {
+            name: os.path.getsize(os.path.join(data_dir, name))
+            for name in ("users.json", "videos.json", "users.snap", "videos.snap")
+        }
+
+        print(f"Dataset: {args.users} users, {args.videos} videos")
+        print(f"{'format':<10}{'load ms':>10}{'peak RSS MB':>14}{'size MB':>10}")
+        for name, result, size in (
+            ("json", json_result, sizes["users.json"] + sizes["videos.json"]),
+            ("snapshot", snapshot_result, sizes["users.snap"] + sizes["videos.snap"]),
+        ):
+            print(f"{name:<10}{result['seconds'] * 1000:>10.1f}"
+                  f"{result['rss_kb'] / 1024:>14.1f}{size / 1024 / 1024:>10.1f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
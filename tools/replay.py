@@ -0,0 +1,201 @@
+"""
+Replay recorded update traffic against the bot's handlers.
+
+Feeds JSONL recordings written with UPDATE_RECORD_DIR through the same
+Application the bot builds, with a fake in-process Bot API, and reports
+throughput and latency. Runs on a temporary copy of the data directory.
+
+Usage:
+    python tools/replay.py recordings/updates-*.jsonl --speed 1
+    python tools/replay.py recordings/*.jsonl --speed 0 --api-latency 40
+
+--speed 1 replays in real time, N replays N times faster, 0 as fast as
+possible. Latency is measured from an update's scheduled arrival to the end
+of its processing, so it includes queueing when the bot falls behind.
+The anti-flood limiter runs on the recorded arrival times, so it drops the
+same updates at any speed.
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+
+class FakeBotAPI(BaseRequest):
+    """Bot API stand-in answering every method with a minimal valid result."""
+
+    BOT_USER = {"id": 1, "is_bot": True, "first_name": "Replay", "username": "replay_bot"}
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_id = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, chat_id) -> dict:
+        self._message_id += 1
+        chat_id = int(chat_id) if str(chat_id).lstrip("-").isdigit() else 1
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "channel"},
+        }
+
+    def _result(self, method: str, params: dict):
+        if method == "getMe":
+            return self.BOT_USER
+        if method == "getChatMember":
+            return {"status": "member", "user": {"id": int(params.get("user_id", 1)), "is_bot": False, "first_name": "U"}}
+        if method == "getChat":
+            return {"id": -1000000000001, "type": "channel", "title": "Replay"}
+        if method == "copyMessage":
+            return {"message_id": self._message(1)["message_id"]}
+        if method.startswith("send") or method.startswith("edit"):
+            return self._message(params.get("chat_id", 1))
+        return True
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        params = request_data.parameters if request_data else {}
+        body = {"ok": True, "result": self._result(api_method, params)}
+        return 200, json.dumps(body).encode("utf-8")
+
+
+def load_records(patterns, limit):
+    """Read recorded updates from JSONL files, ordered by arrival time."""
+    records = []
+
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            with open(path, "r", encoding="utf-8") as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+
+    records.sort(key=lambda record: record["t"])
+    return records[:limit] if limit else records
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def replay(records, speed: float, api: FakeBotAPI):
+    """Process records through the bot's handlers and collect latencies."""
+    import bot
+
+    logging.getLogger().setLevel(logging.WARNING)
+    application = bot.build_application("123456:REPLAY", request=api)
+    errors = Counter()
+
+    async def count_error(update, context):
+        errors[type(context.error).__name__] += 1
+
+    application.add_error_handler(count_error)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+
+    latencies = []
+    types = Counter()
+    first_arrival = records[0]["t"]
+    start = time.perf_counter()
+    
+    # Flood windows follow the recording, not the compressed replay time
+    arrival = {"t": first_arrival}
+    bot.flood_clock = lambda: arrival["t"]
+
+    for record in records:
+        scheduled = start + (record["t"] - first_arrival) / speed if speed else time.perf_counter()
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        arrival["t"] = record["t"]
+        update = Update.de_json(record["update"], application.bot)
+        types[next((key for key in record["update"] if key != "update_id"), "unknown")] += 1
+
+        await application.process_update(update)
+        latencies.append(time.perf_counter() - scheduled)
+
+    elapsed = time.perf_counter() - start
+
+    if application.post_stop:
+        await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+    await application.shutdown()
+
+    return elapsed, sorted(latencies), types, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recordings", nargs="+", help="JSONL recording files or glob patterns")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = real time, N = N times faster, 0 = max")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="simulated Bot API latency in ms")
+    parser.add_argument("--data", default=os.path.join(REPO_ROOT, "data"), help="data directory to start from")
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N updates")
+    args = parser.parse_args()
+
+    records = load_records(args.recordings, args.limit)
+    if not records:
+        print("No updates found in recordings.")
+        return
+
+    workdir = tempfile.mkdtemp(prefix="replay_")
+    try:
+        shutil.copytree(args.data, os.path.join(workdir, "data"))
+        os.chdir(workdir)
+        os.environ["UPDATE_RECORD_DIR"] = ""
+        sys.path.insert(0, REPO_ROOT)
+
+        api = FakeBotAPI(latency=args.api_latency / 1000)
+        elapsed, latencies, types, errors = asyncio.run(replay(records, args.speed, api))
+    finally:
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"Replayed {len(latencies)} updates in {elapsed:.2f}s "
+          f"({len(latencies) / elapsed if elapsed else 0:.1f} updates/s, speed {args.speed:g}x)")
+    print("Latency ms: " + "  ".join(
+        f"{name}={percentile(latencies, fraction) * 1000:.1f}"
+        for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))
+    ))
+    print("Update types: " + ", ".join(f"{name}={count}" for name, count in types.most_common()))
+    print("Bot API calls: " + ", ".join(f"{name}={count}" for name, count in api.calls.most_common()))
+    if errors:
+        print("Handler errors: " + ", ".join(f"{name}={count}" for name, count in errors.most_common()))
+
+
+if __name__ == "__main__":
+    main()